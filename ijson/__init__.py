@@ -9,17 +9,103 @@ Main API:
 - ``ijson.items``: iterator returning Python objects found under a specified prefix,
   see ``ijson.common.items`` for docs.
 
-Top-level ``ijson`` module exposes method from the pure Python backend. There's
-also two other backends using the C library yajl in ``ijson.backends`` that have
-the same API and are faster under CPython.
+- ``ijson.kvitems``: iterator returning (key, value) pairs of the maps found
+  under a specified prefix, see ``ijson.common.kvitems`` for docs.
+
+- ``ijson.basic_parse_batches``, ``ijson.parse_batches``,
+  ``ijson.items_batches``: iterators yielding lists of the events or objects
+  produced from each chunk of input, which saves per-event overhead when
+  processing them in a loop, see ``ijson.common.parse_batches``.
+
+- ``ijson.basic_parse_coro``, ``ijson.parse_coro``, ``ijson.items_coro``,
+  ``ijson.kvitems_coro``: push-based counterparts of the above, coroutines
+  receiving chunks of input through ``send`` (an empty chunk marks the end of
+  input) and sending results to a target, see ``ijson.common.enrich_backend``
+  for docs.
+
+- ``ijson.basic_parse_async``, ``ijson.parse_async``, ``ijson.items_async``,
+  ``ijson.kvitems_async``: asynchronous iterators reading from an object with
+  an awaitable ``read`` method, available under Python 3.5 and newer.
+
+- ``ijson.parallel.items_parallel``: ``items`` over every document of a JSON
+  Lines or concatenated JSON file, parsing parts of the file in a pool of
+  worker processes; ``ijson.parallel.array_items_parallel`` does the same
+  for the items of one large array.
+
+- ``ijson.index``: persistent index of the byte ranges of the values under
+  a prefix in a file, for random access to them.
+
+- ``ijson.Parser``: parser of complete documents given as bytes, reusable
+  for many small ones, see ``ijson.common.Parser``.
+
+- ``ijson.Stats``: statistics collected while parsing when passed as
+  ``stats`` to the iterators above, see ``ijson.instrument``.
+
+Top-level ``ijson`` module exposes methods from the fastest backend available
+in the current environment, trying them in the order given by
+``DEFAULT_BACKENDS``. All backends share the same signatures and accept text
+as well as bytes input. The yajl 1.x backend is never chosen automatically,
+as it accepts trailing data after a document.
+The choice can be pinned by setting the ``IJSON_BACKEND`` environment variable
+to a backend name. The chosen backend module is available as ``ijson.backend``
+and its name as ``ijson.backend_name``; any backend can be loaded explicitly
+with ``ijson.get_backend``.
 '''
-from ijson.common import JSONError, IncompleteJSONError, ObjectBuilder
-import ijson.backends.python as backend
+import os
+from importlib import import_module
+
+from ijson.common import JSONError, IncompleteJSONError, LimitExceededError, ObjectBuilder
+from ijson.instrument import Stats
+from ijson.compat import IS_PY35
 
 
 __version__ = '2.3'
 
 
+# Available backends
+BACKENDS = ('yajl2_cffi', 'yajl2', 'yajl', 'python')
+
+# Backends chosen by default in the order of preference, fastest first
+DEFAULT_BACKENDS = ('yajl2_cffi', 'yajl2', 'python')
+
+
+def get_backend(name):
+    '''
+    Imports and returns the backend module with the given name (one of
+    ``BACKENDS``). Raises ImportError if the backend can't be loaded in the
+    current environment.
+    '''
+    return import_module('ijson.backends.%s' % name)
+
+
+def _default_backend():
+    name = os.environ.get('IJSON_BACKEND')
+    if name:
+        return name, get_backend(name)
+    for name in DEFAULT_BACKENDS:
+        try:
+            return name, get_backend(name)
+        except ImportError:
+            pass
+    raise ImportError('No ijson backend could be loaded')
+
+
+backend_name, backend = _default_backend()
+
 basic_parse = backend.basic_parse
 parse = backend.parse
 items = backend.items
+kvitems = backend.kvitems
+basic_parse_batches = backend.basic_parse_batches
+parse_batches = backend.parse_batches
+items_batches = backend.items_batches
+Parser = backend.Parser
+basic_parse_coro = backend.basic_parse_coro
+parse_coro = backend.parse_coro
+items_coro = backend.items_coro
+kvitems_coro = backend.kvitems_coro
+if IS_PY35:
+    basic_parse_async = backend.basic_parse_async
+    parse_async = backend.parse_async
+    items_async = backend.items_async
+    kvitems_async = backend.kvitems_async
@@ -0,0 +1,102 @@
+'''
+Declarations of the YAJL 2.x API used by the yajl2_cffi backend, and the
+cffi builder of its optional compiled module ``ijson.backends._yajl2_cffi``.
+
+The module is built by ``setup.py`` in cffi's API mode when a C compiler and
+the yajl headers are available. It calls yajl directly instead of through
+``dlopen`` and declares the parser callbacks as ``extern "Python"``, which
+are cheaper to call than callbacks created at run time. Without it, the
+backend falls back to cffi's ABI mode.
+
+This file is also run by cffi on its own at build time, so it may only
+import cffi.
+'''
+
+CDEF = '''
+typedef void * (*yajl_malloc_func)(void *ctx, size_t sz);
+typedef void (*yajl_free_func)(void *ctx, void * ptr);
+typedef void * (*yajl_realloc_func)(void *ctx, void * ptr, size_t sz);
+typedef struct
+{
+    yajl_malloc_func malloc;
+    yajl_realloc_func realloc;
+    yajl_free_func free;
+    void * ctx;
+} yajl_alloc_funcs;
+typedef struct yajl_handle_t * yajl_handle;
+typedef enum {
+    yajl_status_ok,
+    yajl_status_client_canceled,
+    yajl_status_error
+} yajl_status;
+typedef enum {
+    yajl_allow_comments = 0x01,
+    yajl_dont_validate_strings     = 0x02,
+    yajl_allow_trailing_garbage = 0x04,
+    yajl_allow_multiple_values = 0x08,
+    yajl_allow_partial_values = 0x10
+} yajl_option;
+typedef struct {
+    int (* yajl_null)(void * ctx);
+    int (* yajl_boolean)(void * ctx, int boolVal);
+    int (* yajl_integer)(void * ctx, long long integerVal);
+    int (* yajl_double)(void * ctx, double doubleVal);
+    int (* yajl_number)(void * ctx, const char * numberVal,
+                        size_t numberLen);
+    int (* yajl_string)(void * ctx, const unsigned char * stringVal,
+                        size_t stringLen);
+    int (* yajl_start_map)(void * ctx);
+    int (* yajl_map_key)(void * ctx, const unsigned char * key,
+                         size_t stringLen);
+    int (* yajl_end_map)(void * ctx);
+    int (* yajl_start_array)(void * ctx);
+    int (* yajl_end_array)(void * ctx);
+} yajl_callbacks;
+int yajl_version(void);
+yajl_handle yajl_alloc(const yajl_callbacks *callbacks, yajl_alloc_funcs *afs, void *ctx);
+int yajl_config(yajl_handle h, yajl_option opt, ...);
+yajl_status yajl_parse(yajl_handle hand, const unsigned char *jsonText, size_t jsonTextLength);
+yajl_status yajl_complete_parse(yajl_handle hand);
+unsigned char* yajl_get_error(yajl_handle hand, int verbose, const unsigned char *jsonText, size_t jsonTextLength);
+void yajl_free_error(yajl_handle hand, unsigned char * str);
+void yajl_free(yajl_handle handle);
+'''
+
+# Parser callbacks implemented by the backend, with their C parameters
+CALLBACKS = (
+    ('null', 'void *ctx'),
+    ('boolean', 'void *ctx, int boolVal'),
+    ('integer', 'void *ctx, long long integerVal'),
+    ('double', 'void *ctx, double doubleVal'),
+    ('number', 'void *ctx, const char *numberVal, size_t numberLen'),
+    ('string', 'void *ctx, const unsigned char *stringVal, size_t stringLen'),
+    ('raw_string', 'void *ctx, const unsigned char *stringVal, size_t stringLen'),
+    ('start_map', 'void *ctx'),
+    ('map_key', 'void *ctx, const unsigned char *key, size_t stringLen'),
+    ('end_map', 'void *ctx'),
+    ('start_array', 'void *ctx'),
+    ('end_array', 'void *ctx'),
+)
+
+
+def build_ffi():
+    '''
+    Returns the cffi builder of ``ijson.backends._yajl2_cffi``, used by
+    ``setup.py`` through ``cffi_modules``.
+    '''
+    from cffi import FFI
+    ffibuilder = FFI()
+    ffibuilder.cdef(CDEF)
+    ffibuilder.cdef('\n'.join(
+        'extern "Python" int ijson_yajl_%s(%s);' % callback for callback in CALLBACKS
+    ))
+    ffibuilder.set_source(
+        'ijson.backends._yajl2_cffi',
+        '#include <yajl/yajl_parse.h>\n#include <yajl/yajl_version.h>',
+        libraries=['yajl'],
+    )
+    return ffibuilder
+
+
+if __name__ == '__main__':
+    build_ffi().compile(verbose=True)
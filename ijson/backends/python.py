@@ -3,16 +3,29 @@ Pure-python parsing backend.
 '''
 from __future__ import unicode_literals
 import decimal
+import json
 import re
-from codecs import getreader
+import sys
 from json.decoder import scanstring
 
-from ijson import common
-from ijson.compat import bytetype
+from ijson import common, utils
+from ijson.compat import IS_PY2, texttype
 
 
 BUFSIZE = 16 * 1024
-LEXEME_RE = re.compile(r'[a-z0-9eE\.\+-]+|\S')
+# Numbers and literals (as a group) or single symbols
+LEXEME_RE = re.compile(br'([a-z0-9eE\.\+-]+)|\S')
+# The rest of a number or literal, when resuming its scan
+WORD_RE = re.compile(br'[a-z0-9eE\.\+-]*')
+# Anything but brackets, with complete strings as a whole
+SKIP_RE = re.compile(br'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+# Anything but brackets and quotes, for checking the length of skipped strings
+SKIP_UNQUOTED_RE = re.compile(br'[^"\[\]{}]*')
+QUOTE = b'"'
+QUOTE_ORD = ord('"')
+BACKSLASH = ord('\\')
+# lone surrogates escaped in strings are kept when encoding them
+_SURROGATES = 'strict' if IS_PY2 else 'surrogatepass'
 
 
 class UnexpectedSymbol(common.JSONError):
@@ -22,158 +35,485 @@ class UnexpectedSymbol(common.JSONError):
         )
 
 
-def Lexer(f, buf_size=BUFSIZE):
-    if type(f.read(0)) == bytetype:
-        f = getreader('utf-8')(f)
-    buf = f.read(buf_size)
+def _string_end(buf, scan):
+    '''
+    Returns the position of the first unescaped quote in ``buf`` at or after
+    ``scan``, or -1 if there is none. Used to find the end of a string lexeme
+    with ``scan`` pointing past its opening quote.
+    '''
+    end = scan - 1
+    while True:
+        end = buf.find(QUOTE, end + 1)
+        if end == -1:
+            return end
+        escpos = end - 1
+        while buf[escpos] == BACKSLASH:
+            escpos -= 1
+        if (end - escpos) % 2 == 1:
+            return end
+
+
+@utils.coroutine
+def lexer_coro(target, skip=None, max_string_bytes=None, raw_strings=False):
+    '''
+    Coroutine receiving chunks of JSON input, either bytes-like objects or
+    text (encoded into UTF-8), and sending ``(position, lexeme)`` tuples to ``target``. An
+    empty chunk signals the end of input, after which the coroutine finishes.
+    Lexemes that may continue in the next chunk are held back until it
+    arrives.
+
+    Input is scanned as bytes, so only the contents of string lexemes need
+    decoding; positions are byte offsets. The consumed part of the buffer is
+    discarded only once it makes up half of it, and the scan of an unfinished
+    lexeme resumes where it stopped, so lexemes spanning many chunks cost
+    linear time in their length.
+
+    ``skip`` is a list shared with the parser: when the parser puts the
+    opening bracket it has just received into it, the lexer scans over the
+    rest of that container, only tracking strings and brackets, and sends
+    nothing but the matching closing bracket.
+
+    Strings (skipped ones included), numbers and literals longer than
+    ``max_string_bytes`` raise ``common.LimitExceededError``, unfinished ones
+    as soon as the part buffered so far is too long. With ``raw_strings``,
+    string lexemes are sent as bytes, without decoding.
+    '''
+    send = target.send
+    string_limit = sys.maxsize if max_string_bytes is None else max_string_bytes
+    lexeme_search = LEXEME_RE.search
+    word_match = WORD_RE.match
+    # with a limit, skipped strings are stepped over one by one to check them
+    skip_match = (SKIP_RE if max_string_bytes is None else SKIP_UNQUOTED_RE).match
+    buf = bytearray()
     pos = 0
+    # where the scan of an unfinished lexeme continues
+    scan = 0
     discarded = 0
     while True:
-        match = LEXEME_RE.search(buf, pos)
-        if match:
-            lexeme = match.group()
-            if lexeme == '"':
-                pos = match.start()
-                start = pos + 1
-                while True:
-                    try:
-                        end = buf.index('"', start)
-                        escpos = end - 1
-                        while buf[escpos] == '\\':
-                            escpos -= 1
-                        if (end - escpos) % 2 == 0:
-                            start = end + 1
-                        else:
-                            break
-                    except ValueError:
-                        data = f.read(buf_size)
-                        if not data:
+        data = (yield)
+        eof = not data
+        if isinstance(data, texttype):
+            data = data.encode('utf-8')
+        if pos and pos * 2 >= len(buf):
+            del buf[:pos]
+            discarded += pos
+            scan -= pos
+            pos = 0
+        buf += data
+        if scan > pos and buf[pos] != QUOTE_ORD:
+            # resuming the scan of a number or literal held back at the end
+            # of the buffer
+            end = word_match(buf, scan).end()
+            if end - pos > string_limit:
+                raise common.LimitExceededError(
+                    'Number or literal longer than %d bytes' % max_string_bytes)
+            if end == len(buf) and not eof:
+                scan = end
+                continue
+            send((discarded + pos, buf[pos:end].decode('latin-1')))
+            pos = end
+        while True:
+            if skip:
+                if scan <= pos:
+                    # unless resuming an unfinished string, jump over
+                    # everything but brackets in one go
+                    pos = skip_match(buf, pos).end()
+                    if pos == len(buf):
+                        if eof:
+                            raise common.IncompleteJSONError('Incomplete JSON data')
+                        break
+                start = pos
+                char = buf[start:start + 1]
+                if char == QUOTE:
+                    end = _string_end(buf, max(scan, start + 1))
+                    if (len(buf) if end == -1 else end) - start - 1 > string_limit:
+                        raise common.LimitExceededError(
+                            'String longer than %d bytes' % max_string_bytes)
+                    if end == -1:
+                        if eof:
                             raise common.IncompleteJSONError('Incomplete string lexeme')
-                        buf += data
-                yield discarded + pos, buf[pos:end + 1]
+                        pos = start
+                        scan = len(buf)
+                        break
+                    pos = end + 1
+                    continue
+                pos = start + 1
+                char = char.decode('latin-1')
+                if char == '[' or char == '{':
+                    skip.append(char)
+                elif (char == ']') != (skip.pop() == '['):
+                    raise UnexpectedSymbol(char, discarded + start)
+                elif not skip:
+                    send((discarded + start, char))
+                continue
+            match = lexeme_search(buf, pos)
+            if not match:
+                pos = len(buf)
+                break
+            lexeme = match.group()
+            start = match.start()
+            if lexeme == QUOTE:
+                end = _string_end(buf, max(scan, start + 1))
+                if (len(buf) if end == -1 else end) - start - 1 > string_limit:
+                    raise common.LimitExceededError(
+                        'String longer than %d bytes' % max_string_bytes)
+                if end == -1:
+                    if eof:
+                        raise common.IncompleteJSONError('Incomplete string lexeme')
+                    pos = start
+                    scan = len(buf)
+                    break
+                if raw_strings:
+                    send((discarded + start, bytes(buf[start:end + 1])))
+                else:
+                    send((discarded + start, buf[start:end + 1].decode('utf-8')))
                 pos = end + 1
             else:
-                while match.end() == len(buf):
-                    data = f.read(buf_size)
-                    if not data:
-                        break
-                    buf += data
-                    match = LEXEME_RE.search(buf, pos)
-                    lexeme = match.group()
-                yield discarded + match.start(), lexeme
                 pos = match.end()
-        else:
-            data = f.read(buf_size)
-            if not data:
-                break
-            discarded += len(buf)
-            buf = data
-            pos = 0
+                if pos - start > string_limit:
+                    raise common.LimitExceededError(
+                        'Number or literal longer than %d bytes' % max_string_bytes)
+                if pos == len(buf) and not eof and match.lastindex:
+                    # a number or literal may continue in the next chunk
+                    pos = start
+                    scan = len(buf)
+                    break
+                send((discarded + start, lexeme.decode('latin-1')))
+        if eof:
+            break
 
 
-def parse_value(lexer, symbol=None, pos=0):
-    try:
+def Lexer(f, buf_size=BUFSIZE):
+    '''
+    Iterator yielding ``(position, lexeme)`` tuples read from a file-like
+    object.
+    '''
+    return utils.coros2gen(utils.file_source(f, buf_size), (lexer_coro, (), {}))
+
+
+# Parser states
+_VALUE = 0          # expecting any value
+_ARRAY_START = 1    # after "[": expecting a value or "]"
+_MAP_START = 2      # after "{": expecting a key or "}"
+_KEY = 3            # after "," in a map: expecting a key
+_COLON = 4          # after a key: expecting ":"
+_AFTER_VALUE = 5    # after a value in a container: expecting "," or a closing bracket
+_DONE = 6           # after the top-level value
+_SKIPPED = 7        # the lexer is skipping a container
+
+
+@utils.coroutine
+def parser_coro(target, skipper=None, skip=None, use_float=False, multiple_values=False,
+                max_depth=None, raw_strings=False):
+    '''
+    Coroutine receiving ``(position, lexeme)`` tuples and sending unprefixed
+    events to ``target``. A lexeme of None signals the end of input.
+
+    The parser is a state machine keeping open containers on an explicit
+    stack, so the cost of an event doesn't depend on its nesting depth.
+
+    With a ``common.Skipper``, values it refuses are not decoded and produce
+    no events; containers it refuses are put into ``skip``, the list shared
+    with ``lexer_coro``, which then skips over them.
+
+    Numbers are converted with ``common.integer_or_float`` if ``use_float``
+    is set, with ``common.number`` otherwise. With ``multiple_values``,
+    top-level values may follow each other. Map keys are decoded through
+    a ``common.KeyCache``. Containers nested deeper than
+    ``max_depth`` raise ``common.LimitExceededError``.
+
+    With ``raw_strings``, string lexemes are expected as bytes (see
+    ``lexer_coro``) and string values are sent as UTF-8 encoded bytes.
+    '''
+    send = target.send
+    to_number = common.integer_or_float if use_float else common.number
+    if raw_strings:
+        # the first item of bytes, an int under Python 3
+        quote = QUOTE[0]
+        to_string = parse_raw_string
+        keys = common.KeyCache(lambda symbol: parse_string(symbol.decode('utf-8')))
+    else:
+        quote = '"'
+        to_string = parse_string
+        keys = common.KeyCache(parse_string)
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    state = _VALUE
+    while True:
+        pos, symbol = (yield)
         if symbol is None:
-            pos, symbol = next(lexer)
+            if state != _DONE:
+                raise common.IncompleteJSONError('Incomplete JSON data')
+            continue
+
+        if state == _AFTER_VALUE:
+            container = stack[-1]
+            if symbol == ',':
+                state = _VALUE if container == '[' else _KEY
+                continue
+            if symbol == ']' and container == '[':
+                pop()
+                if skipper is not None:
+                    skipper.event('end_array')
+                send(('end_array', None))
+            elif symbol == '}' and container == '{':
+                pop()
+                if skipper is not None:
+                    skipper.event('end_map')
+                send(('end_map', None))
+            else:
+                raise UnexpectedSymbol(symbol, pos)
+            state = _AFTER_VALUE if stack else _DONE
+            continue
+        elif state == _MAP_START or state == _KEY:
+            if symbol == '}' and state == _MAP_START:
+                pop()
+                if skipper is not None:
+                    skipper.event('end_map')
+                send(('end_map', None))
+                state = _AFTER_VALUE if stack else _DONE
+                continue
+            if symbol[0] != quote:
+                raise UnexpectedSymbol(symbol, pos)
+            key = keys[symbol]
+            if skipper is None or skipper.event('map_key', key):
+                send(('map_key', key))
+            state = _COLON
+            continue
+        elif state == _COLON:
+            if symbol != ':':
+                raise UnexpectedSymbol(symbol, pos)
+            state = _VALUE
+            continue
+        elif state == _ARRAY_START:
+            if symbol == ']':
+                pop()
+                if skipper is not None:
+                    skipper.event('end_array')
+                send(('end_array', None))
+                state = _AFTER_VALUE if stack else _DONE
+                continue
+        elif state == _SKIPPED:
+            # the lexer only sends the bracket closing a skipped container
+            skipper.event('end_array' if symbol == ']' else 'end_map')
+            state = _AFTER_VALUE if stack else _DONE
+            continue
+        elif state == _DONE:
+            if not multiple_values:
+                raise common.JSONError('Additional data')
+
+        # Expecting a value
+        if symbol == '[' or symbol == '{':
+            event = 'start_array' if symbol == '[' else 'start_map'
+            if skipper is not None and not skipper.event(event):
+                skip.append(symbol)
+                state = _SKIPPED
+                continue
+            if len(stack) == max_depth:
+                raise common.LimitExceededError('Nesting deeper than %d' % max_depth)
+            push(symbol)
+            send((event, None))
+            state = _ARRAY_START if symbol == '[' else _MAP_START
+            continue
         if symbol == 'null':
-            yield ('null', None)
+            if skipper is None or skipper.event('null'):
+                send(('null', None))
         elif symbol == 'true':
-            yield ('boolean', True)
+            if skipper is None or skipper.event('boolean'):
+                send(('boolean', True))
         elif symbol == 'false':
-            yield ('boolean', False)
-        elif symbol == '[':
-            for event in parse_array(lexer):
-                yield event
-        elif symbol == '{':
-            for event in parse_object(lexer):
-                yield event
-        elif symbol[0] == '"':
-            yield ('string', parse_string(symbol))
-        else:
+            if skipper is None or skipper.event('boolean'):
+                send(('boolean', False))
+        elif symbol[0] == quote:
+            if skipper is None or skipper.event('string'):
+                send(('string', to_string(symbol)))
+        elif skipper is None or skipper.event('number'):
             try:
-                yield ('number', common.number(symbol))
-            except decimal.InvalidOperation:
+                number = to_number(symbol)
+            except (decimal.InvalidOperation, ValueError):
                 raise UnexpectedSymbol(symbol, pos)
-    except StopIteration:
-        raise common.IncompleteJSONError('Incomplete JSON data')
+            send(('number', number))
+        state = _AFTER_VALUE if stack else _DONE
 
 
 def parse_string(symbol):
     return scanstring(symbol, 1)[0]
 
 
-def parse_array(lexer):
-    yield ('start_array', None)
-    try:
-        pos, symbol = next(lexer)
-        if symbol != ']':
-            while True:
-                for event in parse_value(lexer, symbol, pos):
-                    yield event
-                pos, symbol = next(lexer)
-                if symbol == ']':
-                    break
-                if symbol != ',':
-                    raise UnexpectedSymbol(symbol, pos)
-                pos, symbol = next(lexer)
-        yield ('end_array', None)
-    except StopIteration:
-        raise common.IncompleteJSONError('Incomplete JSON data')
+def parse_raw_string(symbol):
+    # contents of a string lexeme given as bytes, decoded only to resolve
+    # escapes
+    if b'\\' not in symbol:
+        return symbol[1:-1]
+    return parse_string(symbol.decode('utf-8')).encode('utf-8', _SURROGATES)
 
 
-def parse_object(lexer):
-    yield ('start_map', None)
-    try:
-        pos, symbol = next(lexer)
-        if symbol != '}':
-            while True:
-                if symbol[0] != '"':
-                    raise UnexpectedSymbol(symbol, pos)
-                yield ('map_key', parse_string(symbol))
-                pos, symbol = next(lexer)
-                if symbol != ':':
-                    raise UnexpectedSymbol(symbol, pos)
-                for event in parse_value(lexer, None, pos):
-                    yield event
-                pos, symbol = next(lexer)
-                if symbol == '}':
-                    break
-                if symbol != ',':
-                    raise UnexpectedSymbol(symbol, pos)
-                pos, symbol = next(lexer)
-        yield ('end_map', None)
-    except StopIteration:
-        raise common.IncompleteJSONError('Incomplete JSON data')
+@utils.coroutine
+def basic_parse_coro(target, multiple_values=False, prefix=None, use_float=False,
+                     max_depth=None, max_string_bytes=None, raw_strings=False):
+    '''
+    Coroutine receiving chunks of JSON input (bytes or text) and sending
+    unprefixed events to ``target``. An empty chunk signals the end of input,
+    after which the coroutine finishes.
 
+    Parameters:
 
-def basic_parse(file, buf_size=BUFSIZE):
+    - target: a coroutine (or anything with a ``send`` method) receiving events
+    - multiple_values: allows the parser to parse multiple JSON values
+    - prefix: if given, values that are neither on the way to, nor under
+      ``prefix`` are skipped without producing events (see
+      ``ijson.common.Skipper``); used by ``items``
+    - use_float: if True, numbers are returned as int or float instead of
+      int or Decimal, which is faster
+    - max_depth: maximum nesting of containers
+    - max_string_bytes: maximum size of strings and map keys in the input,
+      and of numbers and literals, checked before buffering more of an
+      unfinished one
+    - raw_strings: if True, string values are returned as UTF-8 encoded
+      bytes, neither decoded nor checked to be valid UTF-8 unless they
+      contain escapes, which is faster
     '''
-    Iterator yielding unprefixed events.
+    skipper = skip = None
+    if prefix is not None:
+        skipper = common.Skipper(prefix)
+        skip = []
+    parser = parser_coro(target, skipper, skip, use_float, multiple_values, max_depth,
+                         raw_strings)
+    lexer = lexer_coro(parser, skip, max_string_bytes, raw_strings)
+    while True:
+        data = (yield)
+        try:
+            lexer.send(data)
+        except StopIteration:
+            parser.send((None, None))
+            break
 
-    Parameters:
 
-    - file: a readable file-like object with JSON input
+class _Position(object):
     '''
-    lexer = iter(Lexer(file, buf_size))
-    for value in parse_value(lexer):
-        yield value
+    Stands between the lexer and the parser, remembering the last lexeme to
+    tell the byte offset at which it ends. ``base`` is added to the offsets
+    reported by the lexer.
+    '''
+    def __init__(self, parser, base=0):
+        self.parser = parser
+        self.base = base
+        self.pos = self.symbol = None
+
+    def send(self, lexeme):
+        self.pos, self.symbol = lexeme
+        self.parser.send(lexeme)
+
+    def end(self):
+        return self.base + self.pos + len(self.symbol.encode('utf-8'))
+
+
+class _Path(object):
+    '''
+    Stands between the parser and ``common.parse_coro``, keeping track of
+    the open containers as ``[type, key]`` lists, type being "[" or "{" and
+    key the current key of a map.
+    '''
+    def __init__(self, target):
+        self.target = target
+        self.path = []
+
+    def send(self, event):
+        name, value = event
+        if name == 'map_key':
+            self.path[-1][1] = value
+        elif name == 'start_map':
+            self.path.append(['{', None])
+        elif name == 'start_array':
+            self.path.append(['[', None])
+        elif name == 'end_map' or name == 'end_array':
+            self.path.pop()
+        self.target.send(event)
+
+
+class _Checkpoints(list):
+    '''
+    Final target of a resumable pipeline, collecting the objects it produces
+    together with the checkpoint following each of them.
+    '''
+    def __init__(self, position, path):
+        self.position = position
+        self.path = path
+
+    def send(self, obj):
+        checkpoint = {
+            'offset': self.position.end(),
+            'path': [list(container) for container in self.path.path],
+        }
+        self.append((obj, checkpoint))
+
+
+def _replay(path):
+    # JSON text leading a parser to the place described by a checkpoint's
+    # path, where it completes a placeholder value
+    text = ''.join(
+        '[' if container == '[' else '{%s:' % json.dumps(key)
+        for container, key in path
+    )
+    return (text + '""').encode('utf-8')
+
+
+def _resumable(file, prefix, coro, checkpoint, buf_size, use_float=False,
+               multiple_values=False, max_depth=None, max_string_bytes=None,
+               map_type=None, array_type=None):
+    position = _Position(None)
+    path = _Path(None)
+    results = _Checkpoints(position, path)
+    path.target = utils.chain(results, (common.parse_coro, (), {}),
+                              (coro, (prefix, map_type, array_type), {}))
+    skip = []
+    position.parser = parser = parser_coro(path, common.Skipper(prefix), skip,
+                                           use_float, multiple_values, max_depth)
+    lexer = lexer_coro(position, skip, max_string_bytes)
+    offset = None
+    if checkpoint is not None:
+        offset = checkpoint['offset']
+        replay = _replay(checkpoint['path'])
+        position.base = offset - len(replay)
+        lexer.send(replay)
+        del results[:]
     try:
-        next(lexer)
-    except StopIteration:
-        pass
-    else:
-        raise common.JSONError('Additional data')
+        for data in utils.source(file, buf_size, offset):
+            try:
+                lexer.send(data)
+            except StopIteration:
+                parser.send((None, None))
+            for result in results:
+                yield result
+            del results[:]
+    finally:
+        lexer.close()
+        parser.close()
 
 
-def parse(file, buf_size=BUFSIZE):
+def items_resumable(file, prefix, checkpoint=None, buf_size=BUFSIZE, **config):
     '''
-    Backend-specific wrapper for ijson.common.parse.
+    Like ``items``, but yields ``(object, checkpoint)`` tuples. A checkpoint
+    is a dictionary of JSON-serializable values: the byte offset at which
+    its object ends and the path of containers leading to it. Passing it
+    back as ``checkpoint`` resumes parsing right after its object, reading
+    input from that offset (file-like objects need to be seekable).
+
+    Parsing is resumed by feeding the parser a short JSON text that opens the
+    containers of the path, so the same ``prefix`` and options must be used.
+    Supported options are ``use_float``, ``multiple_values``, ``max_depth``,
+    ``max_string_bytes``, ``map_type`` and ``array_type``.
     '''
-    return common.parse(basic_parse(file, buf_size=buf_size))
+    return _resumable(file, prefix, common.items_coro, checkpoint, buf_size, **config)
 
 
-def items(file, prefix):
+def kvitems_resumable(file, prefix, checkpoint=None, buf_size=BUFSIZE, **config):
     '''
-    Backend-specific wrapper for ijson.common.items.
+    Like ``kvitems``, but yields ``((key, value), checkpoint)`` tuples, see
+    ``items_resumable``.
     '''
-    return common.items(parse(file), prefix)
+    return _resumable(file, prefix, common.kvitems_coro, checkpoint, buf_size, **config)
+
+
+common.enrich_backend(globals())
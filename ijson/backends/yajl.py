@@ -2,11 +2,12 @@
 Wrapper for YAJL C library version 1.x.
 '''
 
+import sys
 from ctypes import Structure, c_uint, c_ubyte, c_int, c_long, c_double, c_char, \
                    c_void_p, c_char_p, CFUNCTYPE, POINTER, byref, string_at, cast
 
-from ijson import common, backends
-from ijson.compat import b2s
+from ijson import common, backends, utils
+from ijson.compat import b2s, bytetype, texttype
 
 
 yajl = backends.find_yajl_ctypes(1)
@@ -27,14 +28,15 @@ _callback_data = [
     # inside the parse function.
     ('null', C_EMPTY, lambda: None),
     ('boolean', C_INT, lambda v: bool(v)),
-    # "integer" and "double" aren't actually yielded by yajl since "number"
-    # takes precedence if defined
-    ('integer', C_LONG, lambda v, l: int(string_at(v, l))),
-    ('double', C_DOUBLE, lambda v, l: float(string_at(v, l))),
+    # "integer" and "double" are only used with use_float, since "number"
+    # takes precedence if defined; they produce "number" events
+    ('integer', C_LONG, lambda v: v),
+    ('double', C_DOUBLE, lambda v: v),
     ('number', C_STR, lambda v, l: common.number(b2s(string_at(v, l)))),
     ('string', C_STR, lambda v, l: string_at(v, l).decode('utf-8')),
     ('start_map', C_EMPTY, lambda: None),
-    ('map_key', C_STR, lambda v, l: b2s(string_at(v, l))),
+    # keys are decoded through a common.KeyCache in basic_parse_coro
+    ('map_key', C_STR, None),
     ('end_map', C_EMPTY, lambda: None),
     ('start_array', C_EMPTY, lambda: None),
     ('end_array', C_EMPTY, lambda: None),
@@ -49,66 +51,142 @@ class Config(Structure):
         ("checkUTF8", c_uint)
     ]
 
+BUFSIZE = 64 * 1024
+
 YAJL_OK = 0
 YAJL_CANCELLED = 1
 YAJL_INSUFFICIENT_DATA = 2
 YAJL_ERROR = 3
 
 
-def basic_parse(f, allow_comments=False, check_utf8=False, buf_size=64 * 1024):
+@utils.coroutine
+def basic_parse_coro(target, allow_comments=False, check_utf8=False,
+                     prefix=None, use_float=False,
+                     max_depth=None, max_string_bytes=None, raw_strings=False):
     '''
-    Iterator yielding unprefixed events.
+    Coroutine receiving chunks of JSON input and sending unprefixed events to
+    ``target``. An empty chunk signals the end of input, after which the
+    coroutine finishes. Each chunk is handed directly to ``yajl_parse``.
 
     Parameters:
 
-    - f: a readable file-like object with JSON input
+    - target: a coroutine (or anything with a ``send`` method) receiving events
     - allow_comments: tells parser to allow comments in JSON input
     - check_utf8: if True, parser will cause an error if input is invalid utf-8
-    - buf_size: a size of an input buffer
+    - prefix: if given, values that are neither on the way to, nor under
+      ``prefix`` are not converted and produce no events (see
+      ``ijson.common.Skipper``); used by ``items``
+    - use_float: if True, numbers are returned as int or float converted by
+      yajl itself instead of int or Decimal, which is faster; integers that
+      don't fit into a C long are then rejected by yajl
+    - max_depth, max_string_bytes: resource limits checked on the events
+      produced from each chunk, see ``ijson.common.limits_coro``; skipped
+      strings and keys longer than ``max_string_bytes`` produce events too,
+      as bytes, to be rejected
+    - raw_strings: if True, string values are returned as UTF-8 encoded
+      bytes instead of being decoded, which is faster
     '''
+    if max_depth is not None or max_string_bytes is not None:
+        target = common.limits_coro(target, max_depth, max_string_bytes)
     events = []
+    # exceptions raised by the callbacks, which cancel the parse
+    errors = []
+    skipper = None if prefix is None else common.Skipper(prefix)
+    # skipped strings and keys longer than that are sent as bytes for
+    # limits_coro to reject
+    string_limit = sys.maxsize if max_string_bytes is None else max_string_bytes
+    keys = common.KeyCache(b2s)
 
     def callback(event, func_type, func):
-        def c_callback(context, *args):
-            events.append((event, func(*args)))
-            return 1
+        if skipper is None:
+            def c_callback(context, *args):
+                try:
+                    events.append((event, func(*args)))
+                except Exception as e:
+                    errors.append(e)
+                    return 0
+                return 1
+        elif event == 'map_key':
+            def c_callback(context, *args):
+                try:
+                    value = func(*args)
+                    if skipper.event(event, value):
+                        events.append((event, value))
+                    elif args[1] > string_limit:
+                        events.append((event, string_at(*args)))
+                except Exception as e:
+                    errors.append(e)
+                    return 0
+                return 1
+        elif event == 'string':
+            def c_callback(context, *args):
+                try:
+                    if skipper.event(event):
+                        events.append((event, func(*args)))
+                    elif args[1] > string_limit:
+                        events.append((event, string_at(*args)))
+                except Exception as e:
+                    errors.append(e)
+                    return 0
+                return 1
+        else:
+            def c_callback(context, *args):
+                try:
+                    if skipper.event(event):
+                        events.append((event, func(*args)))
+                except Exception as e:
+                    errors.append(e)
+                    return 0
+                return 1
         return func_type(c_callback)
 
-    callbacks = Callbacks(*[callback(*data) for data in _callback_data])
+    c_callbacks = []
+    for event, func_type, func in _callback_data:
+        # an instance created without arguments is a NULL function pointer
+        if event in ('integer', 'double'):
+            c_callbacks.append(callback('number', func_type, func) if use_float else func_type())
+        elif event == 'number' and use_float:
+            c_callbacks.append(func_type())
+        elif event == 'map_key':
+            c_callbacks.append(callback(event, func_type, lambda v, l: keys[string_at(v, l)]))
+        elif event == 'string' and raw_strings:
+            c_callbacks.append(callback(event, func_type, string_at))
+        else:
+            c_callbacks.append(callback(event, func_type, func))
+    callbacks = Callbacks(*c_callbacks)
     config = Config(allow_comments, check_utf8)
     handle = yajl.yajl_alloc(byref(callbacks), byref(config), None, None)
+    send = target.send
     try:
         while True:
-            buffer = f.read(buf_size)
+            buffer = (yield)
+            if isinstance(buffer, texttype):
+                buffer = buffer.encode('utf-8')
+            elif not isinstance(buffer, bytetype):
+                # ctypes only passes bytes as pointers, so buffers
+                # (like the memoryviews from utils.buffer_source) are copied
+                buffer = memoryview(buffer).tobytes()
             if buffer:
                 result = yajl.yajl_parse(handle, buffer, len(buffer))
             else:
                 result = yajl.yajl_parse_complete(handle)
+            if result == YAJL_CANCELLED:
+                raise errors[0]
             if result == YAJL_ERROR:
                 perror = yajl.yajl_get_error(handle, 1, buffer, len(buffer))
                 error = cast(perror, c_char_p).value
                 yajl.yajl_free_error(handle, perror)
-                exception = common.IncompleteJSONError if result == YAJL_INSUFFICIENT_DATA else common.JSONError
                 raise common.JSONError(error)
-            if not buffer and not events:
+
+            for event in events:
+                send(event)
+            del events[:]
+            if not buffer:
                 if result == YAJL_INSUFFICIENT_DATA:
                     raise common.IncompleteJSONError('Incomplete JSON data')
                 break
-
-            for event in events:
-                yield event
-            events = []
     finally:
         yajl.yajl_free(handle)
 
-def parse(file, **kwargs):
-    '''
-    Backend-specific wrapper for ijson.common.parse.
-    '''
-    return common.parse(basic_parse(file, **kwargs))
 
-def items(file, prefix):
-    '''
-    Backend-specific wrapper for ijson.common.items.
-    '''
-    return common.items(parse(file), prefix)
+common.enrich_backend(globals())
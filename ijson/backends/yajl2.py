@@ -2,11 +2,12 @@
 Wrapper for YAJL C library version 2.x.
 '''
 
-from ctypes import Structure, c_uint, c_ubyte, c_int, c_long, c_double, c_char, \
+import sys
+from ctypes import Structure, c_uint, c_ubyte, c_int, c_longlong, c_double, c_char, \
                    c_void_p, c_char_p, CFUNCTYPE, POINTER, byref, string_at, cast
 
-from ijson import common, backends
-from ijson.compat import b2s
+from ijson import common, backends, utils
+from ijson.compat import b2s, bytetype, texttype
 
 
 yajl = backends.find_yajl_ctypes(2)
@@ -16,7 +17,7 @@ yajl.yajl_get_error.restype = POINTER(c_char)
 
 C_EMPTY = CFUNCTYPE(c_int, c_void_p)
 C_INT = CFUNCTYPE(c_int, c_void_p, c_int)
-C_LONG = CFUNCTYPE(c_int, c_void_p, c_long)
+C_LONGLONG = CFUNCTYPE(c_int, c_void_p, c_longlong)
 C_DOUBLE = CFUNCTYPE(c_int, c_void_p, c_double)
 C_STR = CFUNCTYPE(c_int, c_void_p, POINTER(c_ubyte), c_uint)
 
@@ -27,14 +28,15 @@ _callback_data = [
     # inside the parse function.
     ('null', C_EMPTY, lambda: None),
     ('boolean', C_INT, lambda v: bool(v)),
-    # "integer" and "double" aren't actually yielded by yajl since "number"
-    # takes precedence if defined
-    ('integer', C_LONG, lambda v, l: int(string_at(v, l))),
-    ('double', C_DOUBLE, lambda v, l: float(string_at(v, l))),
+    # "integer" and "double" are only used with use_float, since "number"
+    # takes precedence if defined; they produce "number" events
+    ('integer', C_LONGLONG, lambda v: v),
+    ('double', C_DOUBLE, lambda v: v),
     ('number', C_STR, lambda v, l: common.number(b2s(string_at(v, l)))),
     ('string', C_STR, lambda v, l: string_at(v, l).decode('utf-8')),
     ('start_map', C_EMPTY, lambda: None),
-    ('map_key', C_STR, lambda v, l: b2s(string_at(v, l))),
+    # keys are decoded through a common.KeyCache in basic_parse_coro
+    ('map_key', C_STR, None),
     ('end_map', C_EMPTY, lambda: None),
     ('start_array', C_EMPTY, lambda: None),
     ('end_array', C_EMPTY, lambda: None),
@@ -43,6 +45,8 @@ _callback_data = [
 class Callbacks(Structure):
     _fields_ = [(name, type) for name, type, func in _callback_data]
 
+BUFSIZE = 64 * 1024
+
 YAJL_OK = 0
 YAJL_CANCELLED = 1
 YAJL_INSUFFICIENT_DATA = 2
@@ -50,65 +54,175 @@ YAJL_ERROR = 3
 
 # constants defined in yajl_parse.h
 YAJL_ALLOW_COMMENTS = 1
+YAJL_DONT_VALIDATE_STRINGS = 2
 YAJL_MULTIPLE_VALUES = 8
 
 
-def basic_parse(f, allow_comments=False, buf_size=64 * 1024,
-                multiple_values=False):
-    '''
-    Iterator yielding unprefixed events.
-
-    Parameters:
-
-    - f: a readable file-like object with JSON input
-    - allow_comments: tells parser to allow comments in JSON input
-    - buf_size: a size of an input buffer
-    - multiple_values: allows the parser to parse multiple JSON objects
-    '''
-    events = []
+def _callbacks(events, skipper=None, use_float=False, raw_strings=False,
+               max_string_bytes=None):
+    # a Callbacks structure appending events to the ``events`` list, keeping
+    # the callback functions alive; skipped strings and keys longer than
+    # ``max_string_bytes`` are appended as bytes for limits_coro to reject
+    keys = common.KeyCache(b2s)
+    string_limit = sys.maxsize if max_string_bytes is None else max_string_bytes
 
     def callback(event, func_type, func):
-        def c_callback(context, *args):
-            events.append((event, func(*args)))
-            return 1
+        if skipper is None:
+            def c_callback(context, *args):
+                events.append((event, func(*args)))
+                return 1
+        elif event == 'map_key':
+            def c_callback(context, *args):
+                value = func(*args)
+                if skipper.event(event, value):
+                    events.append((event, value))
+                elif args[1] > string_limit:
+                    events.append((event, string_at(*args)))
+                return 1
+        elif event == 'string':
+            def c_callback(context, *args):
+                if skipper.event(event):
+                    events.append((event, func(*args)))
+                elif args[1] > string_limit:
+                    events.append((event, string_at(*args)))
+                return 1
+        else:
+            def c_callback(context, *args):
+                if skipper.event(event):
+                    events.append((event, func(*args)))
+                return 1
         return func_type(c_callback)
 
-    callbacks = Callbacks(*[callback(*data) for data in _callback_data])
+    c_callbacks = []
+    for event, func_type, func in _callback_data:
+        # an instance created without arguments is a NULL function pointer
+        if event in ('integer', 'double'):
+            c_callbacks.append(callback('number', func_type, func) if use_float else func_type())
+        elif event == 'number' and use_float:
+            c_callbacks.append(func_type())
+        elif event == 'map_key':
+            c_callbacks.append(callback(event, func_type, lambda v, l: keys[string_at(v, l)]))
+        elif event == 'string' and raw_strings:
+            c_callbacks.append(callback(event, func_type, string_at))
+        else:
+            c_callbacks.append(callback(event, func_type, func))
+    return Callbacks(*c_callbacks)
+
+
+def _alloc(callbacks, allow_comments=False, multiple_values=False, check_utf8=True):
     handle = yajl.yajl_alloc(byref(callbacks), None, None)
     if allow_comments:
         yajl.yajl_config(handle, YAJL_ALLOW_COMMENTS, 1)
     if multiple_values:
         yajl.yajl_config(handle, YAJL_MULTIPLE_VALUES, 1)
+    if not check_utf8:
+        yajl.yajl_config(handle, YAJL_DONT_VALIDATE_STRINGS, 1)
+    return handle
+
+
+def _parse(handle, buffer):
+    # parses a chunk of input, an empty one completing the parse
+    if isinstance(buffer, texttype):
+        buffer = buffer.encode('utf-8')
+    elif not isinstance(buffer, bytetype):
+        # ctypes only passes bytes as pointers, so buffers
+        # (like the memoryviews from utils.buffer_source) are copied
+        buffer = memoryview(buffer).tobytes()
+    if buffer:
+        result = yajl.yajl_parse(handle, buffer, len(buffer))
+    else:
+        result = yajl.yajl_complete_parse(handle)
+    if result != YAJL_OK:
+        perror = yajl.yajl_get_error(handle, 1, buffer, len(buffer))
+        error = cast(perror, c_char_p).value
+        yajl.yajl_free_error(handle, perror)
+        exception = common.IncompleteJSONError if result == YAJL_INSUFFICIENT_DATA else common.JSONError
+        # the message quotes the input, which may not be text
+        raise exception(error.decode('utf-8', 'replace'))
+
+
+@utils.coroutine
+def basic_parse_coro(target, allow_comments=False, multiple_values=False,
+                     prefix=None, use_float=False,
+                     max_depth=None, max_string_bytes=None,
+                     raw_strings=False, check_utf8=True):
+    '''
+    Coroutine receiving chunks of JSON input and sending unprefixed events to
+    ``target``. An empty chunk signals the end of input, after which the
+    coroutine finishes. Each chunk is handed directly to ``yajl_parse``.
+
+    Parameters:
+
+    - target: a coroutine (or anything with a ``send`` method) receiving events
+    - allow_comments: tells parser to allow comments in JSON input
+    - multiple_values: allows the parser to parse multiple JSON objects
+    - prefix: if given, values that are neither on the way to, nor under
+      ``prefix`` are not converted and produce no events (see
+      ``ijson.common.Skipper``); used by ``items``
+    - use_float: if True, numbers are returned as int or float converted by
+      yajl itself instead of int or Decimal, which is faster; integers that
+      don't fit into a C long long are then rejected by yajl
+    - max_depth, max_string_bytes: resource limits checked on the events
+      produced from each chunk, see ``ijson.common.limits_coro``; skipped
+      strings and keys longer than ``max_string_bytes`` produce events too,
+      as bytes, to be rejected
+    - raw_strings: if True, string values are returned as UTF-8 encoded
+      bytes instead of being decoded, which is faster
+    - check_utf8: if False, yajl doesn't check strings to be valid UTF-8
+      (``yajl_dont_validate_strings``), which is faster with ``raw_strings``
+    '''
+    if max_depth is not None or max_string_bytes is not None:
+        target = common.limits_coro(target, max_depth, max_string_bytes)
+    events = []
+    skipper = None if prefix is None else common.Skipper(prefix)
+    callbacks = _callbacks(events, skipper, use_float, raw_strings, max_string_bytes)
+    handle = _alloc(callbacks, allow_comments, multiple_values, check_utf8)
+    send = target.send
     try:
         while True:
-            buffer = f.read(buf_size)
-            if buffer:
-                result = yajl.yajl_parse(handle, buffer, len(buffer))
-            else:
-                result = yajl.yajl_complete_parse(handle)
-            if result != YAJL_OK:
-                perror = yajl.yajl_get_error(handle, 1, buffer, len(buffer))
-                error = cast(perror, c_char_p).value
-                yajl.yajl_free_error(handle, perror)
-                exception = common.IncompleteJSONError if result == YAJL_INSUFFICIENT_DATA else common.JSONError
-                raise exception(error.decode('utf-8'))
-            if not buffer and not events:
-                break
-
+            buffer = (yield)
+            _parse(handle, buffer)
             for event in events:
-                yield event
-            events = []
+                send(event)
+            del events[:]
+            if not buffer:
+                break
     finally:
         yajl.yajl_free(handle)
 
-def parse(file, **kwargs):
-    '''
-    Backend-specific wrapper for ijson.common.parse.
-    '''
-    return common.parse(basic_parse(file, **kwargs))
 
-def items(file, prefix):
+class Parser(common.Parser):
     '''
-    Backend-specific wrapper for ijson.common.items.
+    ``ijson.common.Parser`` keeping its yajl callbacks and decoded map keys
+    between documents. yajl 2 can't reset a handle, so only a new handle is
+    allocated for each document. Options are those of ``basic_parse_coro``
+    that apply to whole documents, limits being checked on the events of each
+    document (see ``ijson.common.check_limits``).
     '''
-    return common.items(parse(file), prefix)
+    def __init__(self, map_type=None, array_type=None, allow_comments=False,
+                 multiple_values=False, use_float=False, raw_strings=False,
+                 check_utf8=True, max_depth=None, max_string_bytes=None):
+        super(Parser, self).__init__(map_type, array_type)
+        self.limits = None
+        if max_depth is not None or max_string_bytes is not None:
+            self.limits = (max_depth, max_string_bytes)
+        self.events = []
+        self.callbacks = _callbacks(self.events, None, use_float, raw_strings)
+        self.options = (allow_comments, multiple_values, check_utf8)
+
+    def basic_parse_bytes(self, doc):
+        handle = _alloc(self.callbacks, *self.options)
+        try:
+            if doc:
+                _parse(handle, doc)
+            _parse(handle, b'')
+            events = self.events[:]
+        finally:
+            del self.events[:]
+            yajl.yajl_free(handle)
+        if self.limits is not None:
+            common.check_limits(events, *self.limits)
+        return events
+
+
+common.enrich_backend(globals())
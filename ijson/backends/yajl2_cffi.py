@@ -2,67 +2,26 @@
 CFFI-Wrapper for YAJL C library version 2.x.
 '''
 
-from cffi import FFI
-import functools
 import sys
 
-from ijson import common, backends
-from ijson.compat import b2s
-
-
-ffi = FFI()
-ffi.cdef("""
-typedef void * (*yajl_malloc_func)(void *ctx, size_t sz);
-typedef void (*yajl_free_func)(void *ctx, void * ptr);
-typedef void * (*yajl_realloc_func)(void *ctx, void * ptr, size_t sz);
-typedef struct
-{
-    yajl_malloc_func malloc;
-    yajl_realloc_func realloc;
-    yajl_free_func free;
-    void * ctx;
-} yajl_alloc_funcs;
-typedef struct yajl_handle_t * yajl_handle;
-typedef enum {
-    yajl_status_ok,
-    yajl_status_client_canceled,
-    yajl_status_error
-} yajl_status;
-typedef enum {
-    yajl_allow_comments = 0x01,
-    yajl_dont_validate_strings     = 0x02,
-    yajl_allow_trailing_garbage = 0x04,
-    yajl_allow_multiple_values = 0x08,
-    yajl_allow_partial_values = 0x10
-} yajl_option;
-typedef struct {
-    int (* yajl_null)(void * ctx);
-    int (* yajl_boolean)(void * ctx, int boolVal);
-    int (* yajl_integer)(void * ctx, long long integerVal);
-    int (* yajl_double)(void * ctx, double doubleVal);
-    int (* yajl_number)(void * ctx, const char * numberVal,
-                        size_t numberLen);
-    int (* yajl_string)(void * ctx, const unsigned char * stringVal,
-                        size_t stringLen);
-    int (* yajl_start_map)(void * ctx);
-    int (* yajl_map_key)(void * ctx, const unsigned char * key,
-                         size_t stringLen);
-    int (* yajl_end_map)(void * ctx);
-    int (* yajl_start_array)(void * ctx);
-    int (* yajl_end_array)(void * ctx);
-} yajl_callbacks;
-int yajl_version(void);
-yajl_handle yajl_alloc(const yajl_callbacks *callbacks, yajl_alloc_funcs *afs, void *ctx);
-int yajl_config(yajl_handle h, yajl_option opt, ...);
-yajl_status yajl_parse(yajl_handle hand, const unsigned char *jsonText, size_t jsonTextLength);
-yajl_status yajl_complete_parse(yajl_handle hand);
-unsigned char* yajl_get_error(yajl_handle hand, int verbose, const unsigned char *jsonText, size_t jsonTextLength);
-void yajl_free_error(yajl_handle hand, unsigned char * str);
-void yajl_free(yajl_handle handle);
-""")
-
-
-yajl = backends.find_yajl_cffi(ffi, 2)
+from ijson import common, backends, utils
+from ijson.backends._yajl2_cffi_build import CDEF, CALLBACKS
+from ijson.compat import b2s, bytetype, texttype
+
+
+try:
+    # API mode module built by setup.py, see _yajl2_cffi_build
+    from ijson.backends._yajl2_cffi import ffi, lib as yajl
+    backends.require_version(yajl.yajl_version(), 2)
+    API_MODE = True
+except ImportError:
+    from cffi import FFI
+    ffi = FFI()
+    ffi.cdef(CDEF)
+    yajl = backends.find_yajl_cffi(ffi, 2)
+    API_MODE = False
+
+BUFSIZE = 64 * 1024
 
 YAJL_OK = 0
 YAJL_CANCELLED = 1
@@ -71,110 +30,180 @@ YAJL_ERROR = 3
 
 # constants defined in yajl_parse.h
 YAJL_ALLOW_COMMENTS = 1
+YAJL_DONT_VALIDATE_STRINGS = 2
 YAJL_MULTIPLE_VALUES = 8
 
 
-def append_event_to_ctx(event):
-    def wrapper(func):
-        @functools.wraps(func)
-        def wrapped(ctx, *args, **kwargs):
-            value = func(*args, **kwargs)
-            ctx = ffi.from_handle(ctx)
-            ctx.append((event, value))
-            return 1
-        return wrapped
-    return wrapper
+class _Events(list):
+    # The events produced by a parser, which its callbacks receive as their
+    # context and append to directly, with the parser's skipper and key cache,
+    # and the size over which skipped strings and keys are still appended (as
+    # bytes, for limits_coro to reject them)
+    __slots__ = ('skipper', 'keys', 'string_limit')
+
+
+# The callbacks are shared by all parsers (extern "Python" functions can't be
+# created per parser), so each one finds its parser's events through
+# ffi.from_handle(ctx). Keeping the current events in a module global instead
+# isn't safe: cffi releases the GIL during yajl_parse, so parsers in other
+# threads run their callbacks meanwhile. A threading.local lookup costs about
+# as much as from_handle.
+
+
+def null(ctx):
+    events = ffi.from_handle(ctx)
+    if events.skipper is None or events.skipper.event('null'):
+        events.append(('null', None))
+    return 1
 
 
-@ffi.callback('int(void *ctx)')
-@append_event_to_ctx('null')
-def null():
-    return None
+def boolean(ctx, val):
+    events = ffi.from_handle(ctx)
+    if events.skipper is None or events.skipper.event('boolean'):
+        events.append(('boolean', bool(val)))
+    return 1
 
 
-@ffi.callback('int(void *ctx, int val)')
-@append_event_to_ctx('boolean')
-def boolean(val):
-    return bool(val)
+def integer(ctx, val):
+    events = ffi.from_handle(ctx)
+    if events.skipper is None or events.skipper.event('number'):
+        events.append(('number', int(val)))
+    return 1
 
 
-@ffi.callback('int(void *ctx, long long integerVal)')
-@append_event_to_ctx('integer')
-def integer(val):
-    return int(val)
+def double(ctx, val):
+    events = ffi.from_handle(ctx)
+    if events.skipper is None or events.skipper.event('number'):
+        events.append(('number', float(val)))
+    return 1
 
 
-@ffi.callback('int(void *ctx, double doubleVal)')
-@append_event_to_ctx('double')
-def double(val):
-    return float(val)
+def number(ctx, val, length):
+    events = ffi.from_handle(ctx)
+    if events.skipper is None or events.skipper.event('number'):
+        events.append(('number', common.number(b2s(ffi.string(val, maxlen=length)))))
+    return 1
 
 
-@ffi.callback('int(void *ctx, const char *numberVal, size_t numberLen)')
-@append_event_to_ctx('number')
-def number(val, length):
-    return common.number(b2s(ffi.string(val, maxlen=length)))
+def string(ctx, val, length):
+    events = ffi.from_handle(ctx)
+    if events.skipper is None or events.skipper.event('string'):
+        events.append(('string', ffi.string(val, maxlen=length).decode('utf-8')))
+    elif length > events.string_limit:
+        events.append(('string', ffi.buffer(val, length)[:]))
+    return 1
 
 
-@ffi.callback('int(void *ctx, const unsigned char *stringVal, size_t stringLen)')
-@append_event_to_ctx('string')
-def string(val, length):
-    return ffi.string(val, maxlen=length).decode('utf-8')
+def raw_string(ctx, val, length):
+    events = ffi.from_handle(ctx)
+    if events.skipper is None or events.skipper.event('string') or length > events.string_limit:
+        events.append(('string', ffi.buffer(val, length)[:]))
+    return 1
 
 
-@ffi.callback('int(void *ctx)')
-@append_event_to_ctx('start_map')
-def start_map():
-    return None
+def start_map(ctx):
+    events = ffi.from_handle(ctx)
+    if events.skipper is None or events.skipper.event('start_map'):
+        events.append(('start_map', None))
+    return 1
 
 
-@ffi.callback('int(void *ctx, const unsigned char *key, size_t stringLen)')
-@append_event_to_ctx('map_key')
-def map_key(key, length):
-    return b2s(ffi.string(key, maxlen=length))
+def map_key(ctx, key, length):
+    # keys are decoded through the parser's common.KeyCache
+    events = ffi.from_handle(ctx)
+    value = events.keys[ffi.string(key, maxlen=length)]
+    if events.skipper is None or events.skipper.event('map_key', value):
+        events.append(('map_key', value))
+    elif length > events.string_limit:
+        events.append(('map_key', ffi.buffer(key, length)[:]))
+    return 1
 
 
-@ffi.callback('int(void *ctx)')
-@append_event_to_ctx('end_map')
-def end_map():
-    return None
+def end_map(ctx):
+    events = ffi.from_handle(ctx)
+    if events.skipper is None or events.skipper.event('end_map'):
+        events.append(('end_map', None))
+    return 1
 
 
-@ffi.callback('int(void *ctx)')
-@append_event_to_ctx('start_array')
-def start_array():
-    return None
+def start_array(ctx):
+    events = ffi.from_handle(ctx)
+    if events.skipper is None or events.skipper.event('start_array'):
+        events.append(('start_array', None))
+    return 1
 
 
-@ffi.callback('int(void *ctx)')
-@append_event_to_ctx('end_array')
-def end_array():
-    return None
+def end_array(ctx):
+    events = ffi.from_handle(ctx)
+    if events.skipper is None or events.skipper.event('end_array'):
+        events.append(('end_array', None))
+    return 1
 
 
-_callback_data = (
-    # For more information about callbacks,
-    # take a look at the ctypes backend
-    null, boolean, integer, double, number, string,
-    start_map, map_key, end_map, start_array, end_array
-)
+# C function pointers to the callbacks: the extern "Python" functions of the
+# compiled module, or callbacks created at run time in ABI mode
+_c_callbacks = {}
+if API_MODE:
+    for name, params in CALLBACKS:
+        ffi.def_extern('ijson_yajl_' + name)(globals()[name])
+        _c_callbacks[name] = getattr(yajl, 'ijson_yajl_' + name)
+else:
+    for name, params in CALLBACKS:
+        _c_callbacks[name] = ffi.callback('int(%s)' % params, globals()[name])
 
 
-_asd = list()
-def yajl_init(scope, events, allow_comments=False, multiple_values=False):
+def _callback_data(use_float, raw_strings):
+    # The callbacks in the order of the yajl_callbacks structure. Without the
+    # "number" callback yajl converts numbers itself and calls "integer" or
+    # "double", used with use_float.
+    c = _c_callbacks
+    return (
+        c['null'], c['boolean'], c['integer'], c['double'],
+        ffi.NULL if use_float else c['number'],
+        c['raw_string'] if raw_strings else c['string'],
+        c['start_map'], c['map_key'], c['end_map'], c['start_array'], c['end_array'],
+    )
+
+
+class Container(object):
+    pass
+
+
+def yajl_context(scope, events, prefix=None, use_float=False, raw_strings=False,
+                 max_string_bytes=None):
+    events.skipper = None if prefix is None else common.Skipper(prefix)
+    events.string_limit = sys.maxsize if max_string_bytes is None else max_string_bytes
+    events.keys = common.KeyCache(b2s)
     scope.ctx = ffi.new_handle(events)
-    scope.callbacks = ffi.new('yajl_callbacks*', _callback_data)
+    scope.callbacks = ffi.new('yajl_callbacks*', _callback_data(use_float, raw_strings))
+
+
+def yajl_alloc(scope, allow_comments=False, multiple_values=False, check_utf8=True):
     handle = yajl.yajl_alloc(scope.callbacks, ffi.NULL, scope.ctx)
 
     if allow_comments:
         yajl.yajl_config(handle, YAJL_ALLOW_COMMENTS, ffi.cast('int', 1))
     if multiple_values:
         yajl.yajl_config(handle, YAJL_MULTIPLE_VALUES, ffi.cast('int', 1))
+    if not check_utf8:
+        yajl.yajl_config(handle, YAJL_DONT_VALIDATE_STRINGS, ffi.cast('int', 1))
 
     return handle
 
 
+def yajl_init(scope, events, allow_comments=False, multiple_values=False, prefix=None,
+              use_float=False, raw_strings=False, check_utf8=True, max_string_bytes=None):
+    yajl_context(scope, events, prefix, use_float, raw_strings, max_string_bytes)
+    return yajl_alloc(scope, allow_comments, multiple_values, check_utf8)
+
+
 def yajl_parse(handle, buffer):
+    if isinstance(buffer, texttype):
+        buffer = buffer.encode('utf-8')
+    elif not isinstance(buffer, bytetype):
+        # buffers (like the memoryviews from utils.buffer_source) are passed
+        # to yajl without copying
+        buffer = ffi.from_buffer(buffer) if buffer else b''
     if buffer:
         result = yajl.yajl_parse(handle, buffer, len(buffer))
     else:
@@ -182,62 +211,102 @@ def yajl_parse(handle, buffer):
 
     if result != YAJL_OK:
         perror = yajl.yajl_get_error(handle, 1, buffer, len(buffer))
-        error = b2s(ffi.string(perror))
+        # the message quotes the input, which may not be text
+        error = ffi.string(perror).decode('utf-8', 'replace')
         yajl.yajl_free_error(handle, perror)
         exception = common.IncompleteJSONError if result == YAJL_INSUFFICIENT_DATA else common.JSONError
         raise exception(error)
 
 
-class Container(object):
-    pass
-
-
-def basic_parse(f, buf_size=64*1024, **config):
+@utils.coroutine
+def basic_parse_coro(target, max_depth=None, max_string_bytes=None, **config):
     '''
-    Iterator yielding unprefixed events.
+    Coroutine receiving chunks of JSON input and sending unprefixed events to
+    ``target``. An empty chunk signals the end of input, after which the
+    coroutine finishes. Each chunk is handed directly to ``yajl_parse``.
 
     Parameters:
 
-    - f: a readable file-like object with JSON input
+    - target: a coroutine (or anything with a ``send`` method) receiving events
     - allow_comments: tells parser to allow comments in JSON input
-    - buf_size: a size of an input buffer
     - multiple_values: allows the parser to parse multiple JSON objects
+    - prefix: if given, values that are neither on the way to, nor under
+      ``prefix`` are not converted and produce no events (see
+      ``ijson.common.Skipper``); used by ``items``
+    - use_float: if True, numbers are returned as int or float converted by
+      yajl itself instead of int or Decimal, which is faster; integers that
+      don't fit into a C long long are then rejected by yajl
+    - max_depth, max_string_bytes: resource limits checked on the events
+      produced from each chunk, see ``ijson.common.limits_coro``; skipped
+      strings and keys longer than ``max_string_bytes`` produce events too,
+      as bytes, to be rejected
+    - raw_strings: if True, string values are returned as UTF-8 encoded
+      bytes instead of being decoded, which is faster
+    - check_utf8: if False, yajl doesn't check strings to be valid UTF-8
+      (``yajl_dont_validate_strings``), which is faster with ``raw_strings``
     '''
+    if max_depth is not None or max_string_bytes is not None:
+        target = common.limits_coro(target, max_depth, max_string_bytes)
 
     # the scope objects makes sure the C objects allocated in _yajl.init
     # are kept alive until this function is done
     scope = Container()
-    events = []
+    events = _Events()
+    send = target.send
 
-    handle = yajl_init(scope, events, **config)
+    handle = yajl_init(scope, events, max_string_bytes=max_string_bytes, **config)
     try:
         while True:
-            buffer = f.read(buf_size)
+            buffer = (yield)
             # this calls the callbacks which will
             # fill the events list
             yajl_parse(handle, buffer)
 
-            if not buffer and not events:
-                break
-
             for event in events:
-                yield event
+                send(event)
 
             # clear all events, but don't replace the
             # the events list instance
             del events[:]
+
+            if not buffer:
+                break
     finally:
         yajl.yajl_free(handle)
 
 
-def parse(file, **kwargs):
-    '''
-    Backend-specific wrapper for ijson.common.parse.
-    '''
-    return common.parse(basic_parse(file, **kwargs))
-
-def items(file, prefix):
+class Parser(common.Parser):
     '''
-    Backend-specific wrapper for ijson.common.items.
+    ``ijson.common.Parser`` keeping its yajl callbacks, context and decoded
+    map keys between documents. yajl 2 can't reset a handle, so only a new
+    handle is allocated for each document. Options are those of
+    ``basic_parse_coro`` that apply to whole documents, limits being checked
+    on the events of each document (see ``ijson.common.check_limits``).
     '''
-    return common.items(parse(file), prefix)
+    def __init__(self, map_type=None, array_type=None, allow_comments=False,
+                 multiple_values=False, use_float=False, raw_strings=False,
+                 check_utf8=True, max_depth=None, max_string_bytes=None):
+        super(Parser, self).__init__(map_type, array_type)
+        self.limits = None
+        if max_depth is not None or max_string_bytes is not None:
+            self.limits = (max_depth, max_string_bytes)
+        self.events = _Events()
+        yajl_context(self, self.events, None, use_float, raw_strings)
+        self.options = (allow_comments, multiple_values, check_utf8)
+
+    def basic_parse_bytes(self, doc):
+        handle = yajl_alloc(self, *self.options)
+        try:
+            if doc:
+                yajl_parse(handle, doc)
+            yajl_parse(handle, b'')
+            events = self.events[:]
+        finally:
+            del self.events[:]
+            yajl.yajl_free(handle)
+        if self.limits is not None:
+            common.check_limits(events, *self.limits)
+        return events
+
+
+common.enrich_backend(globals())
@@ -0,0 +1,229 @@
+'''
+Benchmarks comparing the performance of the available backends.
+
+Run ``python -m ijson.benchmark --help`` for the list of options. By default
+all corpora generated by this module are parsed with every backend that can
+be loaded in the current environment, and a table with the throughput of
+``basic_parse``, ``parse`` and ``items`` is printed. Use ``--json`` to get
+machine-readable results instead.
+'''
+from __future__ import print_function
+import argparse
+import io
+import json
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import ijson
+
+
+timer = getattr(time, 'perf_counter', time.time)
+
+METHODS = ('basic_parse', 'parse', 'items')
+
+_corpora = []
+
+
+def corpus(func=None, prefix='item'):
+    '''
+    Registers a function generating a benchmark corpus. The function receives
+    the number of elements to generate and returns a JSON document (bytes);
+    ``items`` is benchmarked with the given ``prefix``. Can be used as
+    ``@corpus`` or ``@corpus(prefix=...)``.
+    '''
+    if func is None:
+        return lambda func: corpus(func, prefix)
+    func.prefix = prefix
+    _corpora.append(func)
+    return func
+
+
+def _array(elements):
+    return ('[' + ', '.join(elements) + ']').encode('utf-8')
+
+
+@corpus
+def numbers(size):
+    return _array(('%d' % i if i % 2 else '%d.%d' % (i, i)) for i in range(size))
+
+
+@corpus
+def strings(size):
+    return _array('"%s"' % ('string \\u0441\\u0442\\u0440 %d ' % i * 10) for i in range(size))
+
+
+@corpus
+def records(size):
+    template = (
+        '{"id": %d, "name": "record %d", "active": %s, "score": %d.5, '
+        '"tags": ["a", "b", "c"], "parent": null}'
+    )
+    return _array(template % (i, i, 'true' if i % 2 else 'false', i) for i in range(size))
+
+
+@corpus
+def nested(size):
+    # every element is 100 levels deep, alternating between maps and arrays
+    depth = 50
+    return _array(
+        '{"a": [' * depth + '%d' % i + ']}' * depth
+        for i in range(max(size // 100, 1))
+    )
+
+
+@corpus(prefix='meta.item')
+def sparse(size):
+    # a small array after a big part of the document "items" doesn't need
+    return ('{"data": %s, "meta": [1, 2, 3]}' % records(size).decode('utf-8')).encode('utf-8')
+
+
+def available_backends(names=None):
+    '''
+    Returns a list of (name, module) tuples for the backends that can be
+    loaded, optionally restricted to the given names.
+    '''
+    result = []
+    for name in names or ijson.BACKENDS:
+        try:
+            result.append((name, ijson.get_backend(name)))
+        except ImportError:
+            pass
+    return result
+
+
+def _run(backend, method, data, buf_size, prefix):
+    f = io.BytesIO(data)
+    if method == 'items':
+        iterator = backend.items(f, prefix, buf_size=buf_size)
+    else:
+        iterator = getattr(backend, method)(f, buf_size=buf_size)
+    count = 0
+    for _ in iterator:
+        count += 1
+    return count
+
+
+def measure(backend, method, data, buf_size, prefix='item', repeat=1, memory=False):
+    '''
+    Parses ``data`` with the given backend method and returns a dictionary
+    with the best time out of ``repeat`` runs, throughput figures and,
+    if ``memory`` is set and tracemalloc is available, peak memory usage.
+    '''
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        count = _run(backend, method, data, buf_size, prefix)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    best = max(best, 1e-9)
+    result = {
+        'method': method,
+        'buf_size': buf_size,
+        'bytes': len(data),
+        'count': count,
+        'seconds': best,
+        'mb_per_sec': len(data) / best / (1024 * 1024),
+        'events_per_sec': count / best,
+        'peak_memory': None,
+    }
+    if memory and tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            _run(backend, method, data, buf_size, prefix)
+            result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run(corpora, backends, methods=METHODS, buf_sizes=(None,), repeat=1, memory=False):
+    '''
+    Runs the benchmarks for every combination of (corpus name, data, prefix),
+    backend, method and buffer size and yields result dictionaries. A buffer
+    size of None stands for the backend's default.
+    '''
+    for corpus_name, data, prefix in corpora:
+        for backend_name, backend in backends:
+            for buf_size in buf_sizes:
+                size = buf_size or backend.BUFSIZE
+                for method in methods:
+                    result = measure(backend, method, data, size, prefix, repeat, memory)
+                    result['corpus'] = corpus_name
+                    result['backend'] = backend_name
+                    yield result
+
+
+def _format(result):
+    memory = result['peak_memory']
+    return '%-10s %-12s %-12s %8d %10.2f %14.0f %12s' % (
+        result['corpus'], result['backend'], result['method'], result['buf_size'],
+        result['mb_per_sec'], result['events_per_sec'],
+        '-' if memory is None else '%.1f KiB' % (memory / 1024.0),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ijson.benchmark',
+        description='Compares the performance of ijson backends',
+    )
+    parser.add_argument('files', nargs='*', help='JSON files to parse instead of generated corpora')
+    parser.add_argument('-c', '--corpus', action='append', choices=[f.__name__ for f in _corpora],
+                        help='generated corpus to use (default: all)')
+    parser.add_argument('-s', '--size', type=int, default=100000,
+                        help='number of elements in generated corpora (default: %(default)s)')
+    parser.add_argument('-B', '--backend', action='append', choices=ijson.BACKENDS,
+                        help='backend to benchmark (default: all available)')
+    parser.add_argument('-m', '--method', action='append', choices=METHODS,
+                        help='method to benchmark (default: all)')
+    parser.add_argument('-b', '--buf-size', action='append', type=int,
+                        help='input buffer size (default: backend default)')
+    parser.add_argument('-p', '--prefix', default='item',
+                        help='prefix used by "items" for the given files (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of runs, the best one is reported (default: %(default)s)')
+    parser.add_argument('-M', '--memory', action='store_true',
+                        help='measure peak memory usage in an additional run')
+    parser.add_argument('-j', '--json', action='store_true', help='output results as JSON')
+    args = parser.parse_args(argv)
+
+    if args.files:
+        corpora = []
+        for name in args.files:
+            with open(name, 'rb') as f:
+                corpora.append((name, f.read(), args.prefix))
+    else:
+        corpora = [
+            (func.__name__, func(args.size), func.prefix)
+            for func in _corpora
+            if not args.corpus or func.__name__ in args.corpus
+        ]
+    backends = available_backends(args.backend)
+    if not backends:
+        parser.error('none of the requested backends can be loaded')
+
+    results = run(corpora, backends, args.method or METHODS, args.buf_size or (None,),
+                  args.repeat, args.memory)
+    if args.json:
+        output = {
+            'ijson': ijson.__version__,
+            'python': sys.version.split()[0],
+            'results': list(results),
+        }
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print('%-10s %-12s %-12s %8s %10s %14s %12s' % (
+            'corpus', 'backend', 'method', 'buf_size', 'MB/s', 'events/s', 'peak memory'))
+        for result in results:
+            print(_format(result))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
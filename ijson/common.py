@@ -3,6 +3,11 @@ Backend independent higher level interfaces, common exceptions.
 '''
 import decimal
 
+from ijson import instrument, utils
+from ijson.compat import IS_PY35, bytetype
+if IS_PY35:
+    from ijson import utils35
+
 
 class JSONError(Exception):
     '''
@@ -18,6 +23,14 @@ class IncompleteJSONError(JSONError):
     pass
 
 
+class LimitExceededError(JSONError):
+    '''
+    Raised as soon as input exceeds one of the resource limits given as
+    backend options (see ``enrich_backend``).
+    '''
+    pass
+
+
 def parse(basic_events):
     '''
     An iterator returning parsing events with the information about their location
@@ -27,8 +40,8 @@ def parse(basic_events):
 
     ('null', None)
     ('boolean', <True or False>)
-    ('number', <int or Decimal>)
-    ('string', <unicode>)
+    ('number', <int or Decimal>, or <int or float> with ``use_float``)
+    ('string', <unicode>, or <bytes> with ``raw_strings``)
     ('map_key', <str>)
     ('start_map', None)
     ('end_map', None)
@@ -61,27 +74,108 @@ def parse(basic_events):
       ('', 'end_map', None)
 
     '''
-    path = []
-    for event, value in basic_events:
+    return utils.coros2gen(basic_events, (parse_coro, (), {}))
+
+
+def parse_async(basic_events):
+    '''
+    Asynchronous counterpart of ``parse``: an asynchronous iterator over
+    the prefixed events built from an asynchronous iterable of unprefixed
+    events. Only available under Python 3.5 and newer.
+    '''
+    return utils35.coros2gen(basic_events, (parse_coro, (), {}))
+
+
+@utils.coroutine
+def parse_coro(target):
+    '''
+    Coroutine receiving unprefixed events and sending the prefixed events
+    described in ``parse`` to ``target``.
+    '''
+    send = target.send
+    # Prefixes of the open containers, the innermost last. The prefix of the
+    # current value is kept ready in ``prefix``, so events only build a new
+    # prefix string when the path actually changes.
+    containers = []
+    push = containers.append
+    pop = containers.pop
+    prefix = ''
+    while True:
+        event, value = (yield)
         if event == 'map_key':
-            prefix = '.'.join(path[:-1])
-            path[-1] = value
+            container = containers[-1]
+            send((container, event, value))
+            prefix = container + '.' + value if len(containers) > 1 else value
         elif event == 'start_map':
-            prefix = '.'.join(path)
-            path.append(None)
-        elif event == 'end_map':
-            path.pop()
-            prefix = '.'.join(path)
+            send((prefix, event, value))
+            push(prefix)
         elif event == 'start_array':
-            prefix = '.'.join(path)
-            path.append('item')
-        elif event == 'end_array':
-            path.pop()
-            prefix = '.'.join(path)
+            send((prefix, event, value))
+            push(prefix)
+            prefix = prefix + '.item' if len(containers) > 1 else 'item'
+        elif event == 'end_map' or event == 'end_array':
+            prefix = pop()
+            send((prefix, event, value))
         else: # any scalar value
-            prefix = '.'.join(path)
+            send((prefix, event, value))
+
+
+def parse_batches(basic_event_batches):
+    '''
+    Batched counterpart of ``parse``: an iterator over lists of prefixed
+    events built from an iterable of lists of unprefixed events (like the
+    ones yielded by a backend's ``basic_parse_batches``). Whole lists are
+    processed in a tight loop, saving the cost of resuming a generator for
+    every single event.
+    '''
+    return utils.coros2gen(basic_event_batches, (parse_batches_coro, (), {}))
+
+
+@utils.coroutine
+def parse_batches_coro(target):
+    '''
+    Coroutine receiving lists of unprefixed events and sending lists of the
+    corresponding prefixed events to ``target``, same as ``parse_coro``
+    does for single events.
+    '''
+    send = target.send
+    containers = []
+    push = containers.append
+    pop = containers.pop
+    prefix = ''
+    while True:
+        batch = []
+        append = batch.append
+        for event, value in (yield):
+            if event == 'map_key':
+                container = containers[-1]
+                append((container, event, value))
+                prefix = container + '.' + value if len(containers) > 1 else value
+            elif event == 'start_map':
+                append((prefix, event, value))
+                push(prefix)
+            elif event == 'start_array':
+                append((prefix, event, value))
+                push(prefix)
+                prefix = prefix + '.item' if len(containers) > 1 else 'item'
+            elif event == 'end_map' or event == 'end_array':
+                prefix = pop()
+                append((prefix, event, value))
+            else: # any scalar value
+                append((prefix, event, value))
+        send(batch)
+
+
+class _Pairs(list):
+    # (key, value) pairs of a map to be built by a map_type factory, and the
+    # key of the map itself in its parent
+    __slots__ = ('key',)
 
-        yield prefix, event, value
+
+class _Values(list):
+    # values of an array to be built by an array_type factory, and the key of
+    # the array itself in its parent
+    __slots__ = ('key',)
 
 
 class ObjectBuilder(object):
@@ -103,51 +197,450 @@ class ObjectBuilder(object):
             builder.event(event, value)
         print builder.value
 
+    Maps are built as dicts and arrays as lists, unless ``map_type`` or
+    ``array_type`` are given: factories called with the list of ``(key,
+    value)`` pairs of a complete map or the list of values of a complete
+    array. For instance, ``tuple`` builds arrays as tuples, and a function
+    like ``lambda pairs: Record(**dict(pairs))`` builds records as objects of
+    a namedtuple or a class with ``__slots__``, taking less memory than dicts.
+    Containers built by factories only appear in ``value`` once complete.
     '''
-    def __init__(self):
-        def initial_set(value):
-            self.value = value
-        self.containers = [initial_set]
+    def __init__(self, map_type=None, array_type=None):
+        self.map_type = map_type
+        self.array_type = array_type
+        self.key = None
+        # the open containers, innermost last
+        self.containers = []
 
     def event(self, event, value):
+        containers = self.containers
         if event == 'map_key':
             self.key = value
-        elif event == 'start_map':
-            map = {}
-            self.containers[-1](map)
-            def setter(value):
-                map[self.key] = value
-            self.containers.append(setter)
+            return
+        if event == 'start_map':
+            if self.map_type is not None:
+                pairs = _Pairs()
+                pairs.key = self.key
+                containers.append(pairs)
+                return
+            value = {}
         elif event == 'start_array':
-            array = []
-            self.containers[-1](array)
-            self.containers.append(array.append)
-        elif event == 'end_array' or event == 'end_map':
+            if self.array_type is not None:
+                values = _Values()
+                values.key = self.key
+                containers.append(values)
+                return
+            value = []
+        elif event == 'end_map' or event == 'end_array':
+            value = containers.pop()
+            if value.__class__ is _Pairs:
+                self.key = value.key
+                value = self.map_type(value)
+            elif value.__class__ is _Values:
+                self.key = value.key
+                value = self.array_type(value)
+            else:
+                return
+        if containers:
+            container = containers[-1]
+            if container.__class__ is dict:
+                container[self.key] = value
+            elif container.__class__ is _Pairs:
+                container.append((self.key, value))
+            else:
+                container.append(value)
+        else:
+            self.value = value
+        if event == 'start_map' or event == 'start_array':
+            containers.append(value)
+
+
+class Parser(object):
+    '''
+    Parser of complete documents given as bytes (or other buffers), reusable
+    for any number of them, which spares small documents the cost of setting
+    up a parsing pipeline for each. Backends provide it as ``Parser``, taking
+    the options of their ``basic_parse_coro`` (except ``prefix``) as keyword
+    arguments; some keep their parsing state between documents. ``map_type``
+    and ``array_type`` are the container factories used by ``parse_bytes``
+    (see ``ObjectBuilder``).
+
+    A Parser must not be used by several threads at once.
+    '''
+    # the backend's basic_parse_coro, set by enrich_backend
+    basic_parse_coro = None
+
+    def __init__(self, map_type=None, array_type=None, **config):
+        self.map_type = map_type
+        self.array_type = array_type
+        self.config = config
+
+    def basic_parse_bytes(self, doc):
+        '''
+        Returns the list of the unprefixed events of a document. By default
+        a ``basic_parse_coro`` coroutine is created for every document.
+        '''
+        events = utils.sendable_list()
+        parser = self.basic_parse_coro(events, **self.config)
+        try:
+            if doc:
+                parser.send(doc)
+            parser.send(b'')
+        except StopIteration:
+            pass
+        return events
+
+    def parse_bytes(self, doc):
+        '''
+        Returns a document as a native Python object.
+        '''
+        builder = ObjectBuilder(self.map_type, self.array_type)
+        event = builder.event
+        for name, value in self.basic_parse_bytes(doc):
+            event(name, value)
+        return builder.value
+
+
+def _child_offset(prefix, offset, segment):
+    '''
+    Given the offset in ``prefix`` at which the path segments of a node's
+    children start (or an offset past the end of ``prefix`` if the node is
+    at or under it), returns the same offset for its child named ``segment``
+    or -1 if the child is neither on the way to, nor under ``prefix``.
+    '''
+    length = len(prefix)
+    if offset > length:
+        return offset
+    end = offset + len(segment)
+    if not prefix.startswith(segment, offset):
+        return -1
+    if end == length:
+        return length + 1
+    if prefix[end] == '.':
+        return end + 1
+    return -1
+
+
+class Skipper(object):
+    '''
+    Decides which unprefixed events are needed to find the values under
+    a given prefix, so that backends can skip the other parts of a document
+    without decoding values or producing events for them.
+
+    Backends call ``event`` with the type of each event before building its
+    value (except for "map_key" events, which need the decoded key) and only
+    produce the event if it returns True. Once ``event`` refuses
+    a "start_map" or "start_array" event, ``depth`` is non-zero until the
+    matching end event, and backends able to skip the whole subtree at once
+    may only report that end event.
+    '''
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.depth = 0
+        self.containers = []
+        # offset of the next value's children segments in prefix,
+        # -1 if the next value must be skipped
+        self.root = self.child = 0 if prefix else 1
+
+    def event(self, event, value=None):
+        if self.depth:
+            if event == 'start_map' or event == 'start_array':
+                self.depth += 1
+            elif event == 'end_map' or event == 'end_array':
+                self.depth -= 1
+                if not self.depth:
+                    self._restore_child()
+            return False
+        if event == 'map_key':
+            self.child = _child_offset(self.prefix, self.containers[-1][1], value)
+            return self.child != -1
+        if event == 'end_map' or event == 'end_array':
             self.containers.pop()
+            self._restore_child()
+            return True
+        if self.child == -1:
+            if event == 'start_map' or event == 'start_array':
+                self.depth = 1
+            return False
+        if event == 'start_map':
+            self.containers.append((False, self.child))
+        elif event == 'start_array':
+            self.child = _child_offset(self.prefix, self.child, 'item')
+            self.containers.append((True, self.child))
+        return True
+
+    def _restore_child(self):
+        # the next value of an array is its next item, of a map -- unknown
+        # until its key arrives, at the top level -- another document
+        if not self.containers:
+            self.child = self.root
         else:
-            self.containers[-1](value)
+            is_array, offset = self.containers[-1]
+            if is_array:
+                self.child = offset
+
 
-def items(prefixed_events, prefix):
+def items(prefixed_events, prefix, map_type=None, array_type=None):
     '''
     An iterator returning native Python objects constructed from the events
-    under a given prefix.
+    under a given prefix. ``map_type`` and ``array_type`` are the container
+    factories described in ``ObjectBuilder``.
     '''
-    prefixed_events = iter(prefixed_events)
+    return utils.coros2gen(prefixed_events, (items_coro, (prefix, map_type, array_type), {}))
+
+
+def items_async(prefixed_events, prefix, map_type=None, array_type=None):
+    '''
+    Asynchronous counterpart of ``items``: an asynchronous iterator over
+    the objects found under a prefix in an asynchronous iterable of prefixed
+    events. Only available under Python 3.5 and newer.
+    '''
+    return utils35.coros2gen(prefixed_events, (items_coro, (prefix, map_type, array_type), {}))
+
+
+@utils.coroutine
+def items_coro(target, prefix, map_type=None, array_type=None):
+    '''
+    Coroutine receiving prefixed events and sending to ``target`` the native
+    Python objects constructed from the events under a given prefix.
+    '''
+    send = target.send
+    while True:
+        current, event, value = (yield)
+        if current == prefix:
+            if event in ('start_map', 'start_array'):
+                builder = ObjectBuilder(map_type, array_type)
+                end_event = event.replace('start', 'end')
+                while (current, event) != (prefix, end_event):
+                    builder.event(event, value)
+                    current, event, value = (yield)
+                builder.event(event, value)
+                send(builder.value)
+            else:
+                send(value)
+
+
+def items_batches(prefixed_event_batches, prefix, map_type=None, array_type=None):
+    '''
+    Batched counterpart of ``items``: an iterator over non-empty lists of
+    the objects found under a given prefix, built from an iterable of lists
+    of prefixed events (see ``parse_batches``).
+    '''
+    return utils.coros2gen(prefixed_event_batches,
+                           (items_batches_coro, (prefix, map_type, array_type), {}))
+
+
+@utils.coroutine
+def items_batches_coro(target, prefix, map_type=None, array_type=None):
+    '''
+    Coroutine receiving lists of prefixed events and sending to ``target``
+    non-empty lists of the objects found under a given prefix, same as
+    ``items_coro`` does for single events. Objects may span several lists.
+    '''
+    send = target.send
+    builder = None
+    while True:
+        objects = []
+        for current, event, value in (yield):
+            if builder is not None:
+                if current == prefix and event == end_event:
+                    builder.event(event, value)
+                    objects.append(builder.value)
+                    builder = None
+                else:
+                    builder.event(event, value)
+            elif current == prefix:
+                if event == 'start_map' or event == 'start_array':
+                    builder = ObjectBuilder(map_type, array_type)
+                    builder.event(event, value)
+                    end_event = 'end_map' if event == 'start_map' else 'end_array'
+                else:
+                    objects.append(value)
+        if objects:
+            send(objects)
+
+
+def kvitems(prefixed_events, prefix, map_type=None, array_type=None):
+    '''
+    An iterator returning ``(key, value)`` tuples for the members of the maps
+    found under a given prefix, with values built as native Python objects.
+    Only one value is built at a time, so memory usage is bounded by the
+    largest value rather than by the whole map. ``map_type`` and
+    ``array_type`` are the container factories described in
+    ``ObjectBuilder``.
+    '''
+    return utils.coros2gen(prefixed_events, (kvitems_coro, (prefix, map_type, array_type), {}))
+
+
+def kvitems_async(prefixed_events, prefix, map_type=None, array_type=None):
+    '''
+    Asynchronous counterpart of ``kvitems``. Only available under Python 3.5
+    and newer.
+    '''
+    return utils35.coros2gen(prefixed_events, (kvitems_coro, (prefix, map_type, array_type), {}))
+
+
+@utils.coroutine
+def kvitems_coro(target, prefix, map_type=None, array_type=None):
+    '''
+    Coroutine receiving prefixed events and sending to ``target`` the
+    ``(key, value)`` tuples described in ``kvitems``.
+    '''
+    send = target.send
+    while True:
+        current, event, value = (yield)
+        while current == prefix and event == 'map_key':
+            key = value
+            builder = ObjectBuilder(map_type, array_type)
+            depth = 0
+            while True:
+                current, event, value = (yield)
+                builder.event(event, value)
+                if event == 'start_map' or event == 'start_array':
+                    depth += 1
+                elif event == 'end_map' or event == 'end_array':
+                    depth -= 1
+                if not depth:
+                    break
+            send((key, builder.value))
+            current, event, value = (yield)
+
+
+@utils.coroutine
+def limits_coro(target, max_depth=None, max_string_bytes=None):
+    '''
+    Coroutine checking the unprefixed events it forwards to ``target``
+    against the ``max_depth`` and ``max_string_bytes`` limits, for backends
+    that can't check them while parsing.
+    '''
+    send = target.send
+    depth = 0
+    while True:
+        event = (yield)
+        name, value = event
+        if name == 'start_map' or name == 'start_array':
+            depth += 1
+            if max_depth is not None and depth > max_depth:
+                raise LimitExceededError('Nesting deeper than %d' % max_depth)
+        elif name == 'end_map' or name == 'end_array':
+            depth -= 1
+        elif (name == 'string' or name == 'map_key') and max_string_bytes is not None:
+            size = len(value)
+            if size * 4 > max_string_bytes and not isinstance(value, bytetype):
+                size = len(value.encode('utf-8'))
+            if size > max_string_bytes:
+                raise LimitExceededError('String longer than %d bytes' % max_string_bytes)
+        send(event)
+
+
+def check_limits(events, max_depth=None, max_string_bytes=None):
+    '''
+    Checks a list of unprefixed events against the limits of
+    ``limits_coro``, raising ``LimitExceededError`` if one is exceeded.
+    '''
+    check = limits_coro(utils.sendable_list(), max_depth, max_string_bytes).send
+    for event in events:
+        check(event)
+
+
+@utils.coroutine
+def total_bytes_coro(target, basic_parse_coro, max_total_bytes, **config):
+    '''
+    Coroutine forwarding chunks of input to a ``basic_parse_coro`` coroutine
+    created with ``target`` and ``config``, failing as soon as they add up
+    to more than ``max_total_bytes``.
+    '''
+    parser = basic_parse_coro(target, **config)
+    send = parser.send
+    total = 0
     try:
         while True:
-            current, event, value = next(prefixed_events)
-            if current == prefix:
-                if event in ('start_map', 'start_array'):
-                    builder = ObjectBuilder()
-                    end_event = event.replace('start', 'end')
-                    while (current, event) != (prefix, end_event):
-                        builder.event(event, value)
-                        current, event, value = next(prefixed_events)
-                    yield builder.value
-                else:
-                    yield value
-    except StopIteration:
-        pass
+            data = (yield)
+            total += len(data)
+            if total > max_total_bytes:
+                raise LimitExceededError('Input longer than %d bytes' % max_total_bytes)
+            try:
+                send(data)
+            except StopIteration:
+                break
+    finally:
+        parser.close()
+
+
+@utils.coroutine
+def item_bytes_coro(target, prefix, max_item_bytes, pairs=False):
+    '''
+    Coroutine forwarding prefixed events to ``target`` (``items_coro`` or
+    ``kvitems_coro``), failing as soon as the objects under ``prefix`` they
+    build exceed ``max_item_bytes``. An object's size is estimated from its
+    events as the length of its strings and map keys plus one for every
+    other value or bracket, which never exceeds its size in the input. With
+    ``pairs`` (for ``kvitems_coro``), each key of the maps at ``prefix`` and
+    its value are counted on their own instead of the whole map.
+    '''
+    send = target.send
+    subprefix = prefix + '.'
+    size = 0
+    while True:
+        event = (yield)
+        current, name, value = event
+        if current == prefix or not prefix or current.startswith(subprefix):
+            if pairs and current == prefix:
+                # a new member of a map at the prefix, or its brackets
+                size = 0
+            if name == 'string' or name == 'map_key':
+                size += len(value) + 2
+            else:
+                size += 1
+            if size > max_item_bytes:
+                raise LimitExceededError('Object longer than %d bytes' % max_item_bytes)
+            if current == prefix and name not in ('start_map', 'start_array', 'map_key'):
+                # end of an object at the prefix
+                size = 0
+        send(event)
+
+
+@utils.coroutine
+def item_bytes_batches_coro(target, prefix, max_item_bytes):
+    '''
+    Batched counterpart of ``item_bytes_coro``, forwarding lists of prefixed
+    events to ``items_batches_coro``.
+    '''
+    checked = utils.sendable_list()
+    check = item_bytes_coro(checked, prefix, max_item_bytes).send
+    send = target.send
+    while True:
+        batch = (yield)
+        for event in batch:
+            check(event)
+        del checked[:]
+        send(batch)
+
+
+# Number of distinct map keys a backend keeps decoded
+KEY_CACHE_SIZE = 1024
+
+
+class KeyCache(dict):
+    '''
+    Cache of decoded map keys used by backends, mapping keys as they appear
+    in the input (bytes or a lexeme) to the strings returned by ``decode``.
+    Repeated keys are decoded once and share one string object, also in the
+    objects built from them. Once ``size`` keys are cached, the cache is
+    cleared to make room for new ones, so documents with many distinct keys
+    cost little more than decoding every key.
+    '''
+    def __init__(self, decode, size=KEY_CACHE_SIZE):
+        super(KeyCache, self).__init__()
+        self.decode = decode
+        self.size = size
+
+    def __missing__(self, raw):
+        key = self.decode(raw)
+        if len(self) >= self.size:
+            self.clear()
+        self[raw] = key
+        return key
 
 
 def number(str_value):
@@ -159,3 +652,266 @@ def number(str_value):
     if not ('.' in str_value or 'e' in str_value or 'E' in str_value):
         number = int(number)
     return number
+
+
+def integer_or_float(str_value):
+    '''
+    Converts string with a numeric value into an int or a float. Faster
+    alternative to ``number`` used when backends are asked to use floats.
+    '''
+    if '.' in str_value or 'e' in str_value or 'E' in str_value:
+        return float(str_value)
+    return int(str_value)
+
+
+def enrich_backend(backend):
+    '''
+    Completes the namespace of a backend module (passed as its ``globals()``)
+    with the public API built on top of its ``basic_parse_coro`` coroutine and
+    ``BUFSIZE`` default:
+
+    - ``basic_parse``, ``parse``, ``items`` and ``kvitems``: iterators over
+      a readable file-like object, a path or a buffer (like bytes or mmap),
+      which is read in chunks of ``buf_size`` bytes.
+    - ``basic_parse_batches``, ``parse_batches`` and ``items_batches``:
+      batched counterparts of the above, yielding the results produced from
+      each chunk of input together in a list.
+    - ``parse_coro``, ``items_coro`` and ``kvitems_coro``: push-based
+      counterparts receiving chunks of input through ``send``, with an empty
+      chunk signalling the end of input. They send prefixed events or objects
+      to their ``target``.
+    - ``basic_parse_async``, ``parse_async``, ``items_async`` and
+      ``kvitems_async``: asynchronous iterators over an object with an
+      awaitable ``read`` method (like ``asyncio.StreamReader``), to be used
+      with ``async for``. Only available under Python 3.5 and newer.
+
+    A ``Parser`` class (see ``ijson.common.Parser``) is added unless the
+    backend defines its own.
+
+    The iterators over files take an optional ``stats`` argument, an
+    ``ijson.instrument.Stats`` object collecting statistics while parsing.
+    Functions of the ``items`` and ``kvitems`` families take optional
+    ``map_type`` and ``array_type`` container factories (see
+    ``ObjectBuilder``).
+
+    Backend options (like ``allow_comments``) are passed as keyword arguments
+    and forwarded to ``basic_parse_coro``, so that all backends share the
+    same signatures. A boolean ``buf_size`` (like in ``basic_parse(f, True)``,
+    which once meant ``allow_comments`` for the yajl backends) raises
+    TypeError. The ``items`` and ``kvitems`` families also pass their prefix
+    as the ``prefix`` option, letting the backend skip the parts of the
+    document that can't contain the requested objects (see ``Skipper``).
+
+    Resource limits protecting against pathological input are passed the same
+    way, ``LimitExceededError`` being raised as soon as one is exceeded:
+
+    - ``max_depth``: maximum nesting of containers
+    - ``max_string_bytes``: maximum size of a string or map key in bytes
+    - ``max_item_bytes``: maximum size of an object built by ``items`` or
+      ``items_batches`` (or of a key and its value returned by ``kvitems``),
+      see ``item_bytes_coro``
+    - ``max_total_bytes``: maximum size of the whole input
+
+    The first two are checked by the backends while parsing, strings skipped
+    as irrelevant to ``items`` included, the other two by coroutines added to
+    the pipelines.
+
+    The iterators over files and their batched counterparts also take a
+    ``prefetch`` option: when given, up to that many chunks of input are read
+    ahead by a background thread while the current one is parsed (see
+    ``ijson.utils.prefetch_source``), overlapping I/O with parsing.
+
+    Their input is decompressed on the fly when it's gzip, bzip2 or xz data,
+    which is detected by its first bytes (see
+    ``ijson.utils.decompress_source``), so paths of compressed files can be
+    passed as is. With ``prefetch`` decompression also happens in the
+    background thread, overlapping with parsing. Passing ``decompress=False``
+    turns the detection off.
+    '''
+    basic_parse_coro = backend['basic_parse_coro']
+    default_buf_size = backend['BUFSIZE']
+
+    def stages(config, pipeline=(), prefix=None):
+        # the coroutines of a pipeline, with the checks of the limits not
+        # enforced by the backend itself
+        config = dict(config)
+        max_total_bytes = config.pop('max_total_bytes', None)
+        max_item_bytes = config.pop('max_item_bytes', None)
+        if prefix is not None:
+            config['prefix'] = prefix
+        if max_total_bytes is None:
+            first = (basic_parse_coro, (), config)
+        else:
+            first = (total_bytes_coro, (basic_parse_coro, max_total_bytes), config)
+        pipeline = list(pipeline)
+        if max_item_bytes is not None:
+            if prefix is None:
+                raise TypeError('max_item_bytes only applies to items, kvitems and items_batches')
+            pairs = pipeline[-1][0] is kvitems_coro
+            pipeline.insert(-1, (item_bytes_coro, (prefix, max_item_bytes, pairs), {}))
+        return [first] + pipeline
+
+    def input_chunks(file, buf_size, config):
+        # the chunks of input, decompressed and read ahead by a thread if
+        # asked to
+        if isinstance(buf_size, bool):
+            raise TypeError('buf_size must be an integer, backend options are keyword arguments')
+        config = dict(config)
+        prefetch = config.pop('prefetch', None)
+        chunks = utils.source(file, buf_size)
+        if config.pop('decompress', True):
+            chunks = utils.decompress_source(chunks, buf_size)
+        if prefetch:
+            chunks = utils.prefetch_source(chunks, prefetch)
+        return chunks, config
+
+    def run(file, buf_size, stats, config, pipeline=(), prefix=None):
+        chunks, config = input_chunks(file, buf_size, config)
+        pipeline = stages(config, pipeline, prefix)
+        if stats is not None:
+            return instrument.coros2gen(chunks, stats, pipeline[0], pipeline[1:], prefix)
+        return utils.coros2gen(chunks, *pipeline)
+
+    def basic_parse(file, buf_size=default_buf_size, stats=None, **config):
+        '''
+        Iterator yielding unprefixed events.
+
+        Parameters:
+
+        - file: JSON input, either a readable file-like object, a path (a
+          text string, ``unicode`` under Python 2) or an object supporting
+          the buffer protocol like bytes or mmap (see ``ijson.utils.source``)
+        - buf_size: a size of an input buffer
+        - stats: an ``ijson.instrument.Stats`` object collecting statistics
+          while parsing, if given
+        - config: backend-specific options, see ``basic_parse_coro``
+        '''
+        return run(file, buf_size, stats, config)
+
+    def parse(file, buf_size=default_buf_size, stats=None, **config):
+        '''
+        Backend-specific wrapper for ijson.common.parse.
+        '''
+        return run(file, buf_size, stats, config, [(parse_coro, (), {})])
+
+    def items(file, prefix, buf_size=default_buf_size, stats=None,
+              map_type=None, array_type=None, **config):
+        '''
+        Backend-specific wrapper for ijson.common.items.
+        '''
+        return run(file, buf_size, stats, config,
+                   [(parse_coro, (), {}), (items_coro, (prefix, map_type, array_type), {})],
+                   prefix)
+
+    def kvitems(file, prefix, buf_size=default_buf_size, stats=None,
+                map_type=None, array_type=None, **config):
+        '''
+        Backend-specific wrapper for ijson.common.kvitems.
+        '''
+        return run(file, buf_size, stats, config,
+                   [(parse_coro, (), {}), (kvitems_coro, (prefix, map_type, array_type), {})],
+                   prefix)
+
+    def basic_parse_batches(file, buf_size=default_buf_size, **config):
+        '''
+        Batched counterpart of ``basic_parse``: iterator yielding the
+        unprefixed events produced from each chunk of input together in
+        a list.
+        '''
+        chunks, config = input_chunks(file, buf_size, config)
+        return utils.coros2batches(chunks, *stages(config))
+
+    def backend_parse_batches(file, buf_size=default_buf_size, **config):
+        '''
+        Backend-specific wrapper for ijson.common.parse_batches.
+        '''
+        return parse_batches(basic_parse_batches(file, buf_size, **config))
+
+    def backend_items_batches(file, prefix, buf_size=default_buf_size,
+                              map_type=None, array_type=None, **config):
+        '''
+        Backend-specific wrapper for ijson.common.items_batches.
+        '''
+        config = dict(config, prefix=prefix)
+        max_item_bytes = config.pop('max_item_bytes', None)
+        events = parse_batches(basic_parse_batches(file, buf_size, **config))
+        if max_item_bytes is None:
+            return items_batches(events, prefix, map_type, array_type)
+        return utils.coros2gen(events,
+                               (item_bytes_batches_coro, (prefix, max_item_bytes), {}),
+                               (items_batches_coro, (prefix, map_type, array_type), {}))
+
+    def backend_parse_coro(target, **config):
+        '''
+        Push-based counterpart of ``parse``.
+        '''
+        return utils.chain(target, *stages(config, [(parse_coro, (), {})]))
+
+    def backend_items_coro(target, prefix, map_type=None, array_type=None, **config):
+        '''
+        Push-based counterpart of ``items``.
+        '''
+        pipeline = [(parse_coro, (), {}), (items_coro, (prefix, map_type, array_type), {})]
+        return utils.chain(target, *stages(config, pipeline, prefix))
+
+    def backend_kvitems_coro(target, prefix, map_type=None, array_type=None, **config):
+        '''
+        Push-based counterpart of ``kvitems``.
+        '''
+        pipeline = [(parse_coro, (), {}), (kvitems_coro, (prefix, map_type, array_type), {})]
+        return utils.chain(target, *stages(config, pipeline, prefix))
+
+    def basic_parse_async(file, buf_size=default_buf_size, **config):
+        '''
+        Asynchronous counterpart of ``basic_parse``.
+        '''
+        return utils35.coros2gen(utils35.file_source(file, buf_size), *stages(config))
+
+    def parse_async(file, buf_size=default_buf_size, **config):
+        '''
+        Asynchronous counterpart of ``parse``.
+        '''
+        return utils35.coros2gen(utils35.file_source(file, buf_size),
+                                 *stages(config, [(parse_coro, (), {})]))
+
+    def items_async(file, prefix, buf_size=default_buf_size,
+                    map_type=None, array_type=None, **config):
+        '''
+        Asynchronous counterpart of ``items``.
+        '''
+        pipeline = [(parse_coro, (), {}), (items_coro, (prefix, map_type, array_type), {})]
+        return utils35.coros2gen(utils35.file_source(file, buf_size),
+                                 *stages(config, pipeline, prefix))
+
+    def kvitems_async(file, prefix, buf_size=default_buf_size,
+                      map_type=None, array_type=None, **config):
+        '''
+        Asynchronous counterpart of ``kvitems``.
+        '''
+        pipeline = [(parse_coro, (), {}), (kvitems_coro, (prefix, map_type, array_type), {})]
+        return utils35.coros2gen(utils35.file_source(file, buf_size),
+                                 *stages(config, pipeline, prefix))
+
+    class BackendParser(Parser):
+        '''
+        ``ijson.common.Parser`` of the backend.
+        '''
+        basic_parse_coro = staticmethod(backend['basic_parse_coro'])
+
+    backend.setdefault('Parser', BackendParser)
+    backend['basic_parse'] = basic_parse
+    backend['parse'] = parse
+    backend['items'] = items
+    backend['kvitems'] = kvitems
+    backend['basic_parse_batches'] = basic_parse_batches
+    backend['parse_batches'] = backend_parse_batches
+    backend['items_batches'] = backend_items_batches
+    backend['parse_coro'] = backend_parse_coro
+    backend['items_coro'] = backend_items_coro
+    backend['kvitems_coro'] = backend_kvitems_coro
+    if IS_PY35:
+        backend['basic_parse_async'] = basic_parse_async
+        backend['parse_async'] = parse_async
+        backend['items_async'] = items_async
+        backend['kvitems_async'] = kvitems_async
+
@@ -6,11 +6,16 @@ import sys
 
 
 IS_PY2 = sys.version_info[0] < 3
+IS_PY35 = sys.version_info[:2] >= (3, 5)
 
 
 if IS_PY2:
+    import Queue as queue
     b2s = lambda s: s
     bytetype = str
+    texttype = unicode
 else:
+    import queue
     b2s = lambda b: b.decode('utf-8')
     bytetype = bytes
+    texttype = str
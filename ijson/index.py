@@ -0,0 +1,184 @@
+'''
+Persistent index of the byte ranges of the values under a prefix in a JSON
+file, giving random access to them without parsing the rest of the file.
+
+``build`` scans the file once (see ``ijson.parallel.element_ranges``) and
+stores the start and end offsets of every value into an index file next to
+it; ``get`` and ``slice`` then read and parse only the requested values::
+
+    ijson.index.build('dump.json', 'item')
+    ijson.index.get('dump.json', 1000000)
+    ijson.index.slice('dump.json', 10, 20)
+
+The index file starts with a header holding the size and modification time
+of the indexed file. When they don't match the file anymore, the index is
+rebuilt with the same prefix before being used.
+'''
+import os
+import struct
+
+import ijson
+from ijson import parallel
+
+
+MAGIC = b'IJSONIDX'
+VERSION = 1
+
+# magic, version, size and modification time (ns) of the indexed file,
+# number of entries, length of the UTF-8 encoded prefix which follows
+_HEADER = struct.Struct('<8sIQqQI')
+# start and end offsets of a value
+_ENTRY = struct.Struct('<QQ')
+
+# Number of entries packed and written at once
+_BATCH = 4096
+
+# the builtin, shadowed by this module's slice function
+_slice = slice
+
+
+def index_path(path):
+    '''
+    Returns the path of the index file of the JSON file at ``path``.
+    '''
+    return path + '.ijsonidx'
+
+
+def _stat(path):
+    stat = os.stat(path)
+    mtime = getattr(stat, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(stat.st_mtime * 1e9)
+    return stat.st_size, mtime
+
+
+class Index(object):
+    '''
+    Header of an index file: the ``prefix`` of the indexed values, their
+    number (``len``), and the ``size`` and ``mtime`` of the indexed file.
+    Entries are read from the index file on demand.
+    '''
+    def __init__(self, path, prefix, count, size, mtime):
+        self.path = path
+        self.prefix = prefix
+        self.count = count
+        self.size = size
+        self.mtime = mtime
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def read(cls, path):
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                raise ValueError('%s is not an ijson index' % path)
+            magic, version, size, mtime, count, length = _HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('%s is not an ijson index' % path)
+            prefix = f.read(length).decode('utf-8')
+        return cls(path, prefix, count, size, mtime)
+
+    def _entries_offset(self):
+        return _HEADER.size + len(self.prefix.encode('utf-8'))
+
+    def ranges(self, start, stop):
+        '''
+        Returns a list of the ``(start, end)`` byte ranges of the values
+        ``start`` to ``stop`` (excluded).
+        '''
+        with open(self.path, 'rb') as f:
+            f.seek(self._entries_offset() + start * _ENTRY.size)
+            data = f.read((stop - start) * _ENTRY.size)
+        return [_ENTRY.unpack_from(data, pos) for pos in range(0, len(data), _ENTRY.size)]
+
+
+def build(path, prefix, index=None):
+    '''
+    Scans the JSON file at ``path`` for the values under ``prefix`` and
+    writes the index of their byte ranges into the ``index`` file
+    (``index_path(path)`` by default), replacing it atomically. Returns the
+    new ``Index``.
+    '''
+    index = index or index_path(path)
+    size, mtime = _stat(path)
+    encoded_prefix = prefix.encode('utf-8')
+    tmp = index + '.tmp'
+    count = 0
+    try:
+        with open(tmp, 'wb') as f, open(path, 'rb') as data:
+            f.write(_HEADER.pack(MAGIC, VERSION, size, mtime, 0, len(encoded_prefix)))
+            f.write(encoded_prefix)
+            batch = []
+            # the file is passed open, as paths given as byte strings would be
+            # taken for the data itself (see utils.source)
+            for start, end in parallel.element_ranges(data, prefix):
+                batch.append(_ENTRY.pack(start, end))
+                if len(batch) == _BATCH:
+                    f.write(b''.join(batch))
+                    count += len(batch)
+                    batch = []
+            f.write(b''.join(batch))
+            count += len(batch)
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, VERSION, size, mtime, count, len(encoded_prefix)))
+        getattr(os, 'replace', os.rename)(tmp, index)
+    except BaseException:
+        # a failed scan (like of a truncated file) leaves no partial index
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return Index(index, prefix, count, size, mtime)
+
+
+def load(path, index=None):
+    '''
+    Returns the ``Index`` of the JSON file at ``path`` read from the
+    ``index`` file (``index_path(path)`` by default), rebuilding it if the
+    JSON file has changed since it was built.
+    '''
+    index = index or index_path(path)
+    result = Index.read(index)
+    if (result.size, result.mtime) != _stat(path):
+        result = build(path, result.prefix, index)
+    return result
+
+
+def _parse(f, start, end, backend, config):
+    f.seek(start)
+    data = f.read(end - start)
+    return next(ijson.get_backend(backend).items(data, '', **config))
+
+
+def get(path, i, index=None, backend=None, **config):
+    '''
+    Returns the ``i``-th indexed value of the JSON file at ``path`` as
+    a native Python object, parsing nothing else. Negative indices count
+    from the end; IndexError is raised for indices out of range.
+
+    ``backend`` is the name of the backend to use, the fastest one by
+    default, and ``config`` holds its options (see ``basic_parse_coro``).
+    '''
+    idx = load(path, index)
+    if i < 0:
+        i += len(idx)
+    if not 0 <= i < len(idx):
+        raise IndexError('index out of range')
+    (start, end), = idx.ranges(i, i + 1)
+    with open(path, 'rb') as f:
+        return _parse(f, start, end, backend or ijson.backend_name, config)
+
+
+def slice(path, start=None, stop=None, index=None, backend=None, **config):
+    '''
+    Iterator returning the indexed values ``start`` to ``stop`` (excluded,
+    with the semantics of Python slices) of the JSON file at ``path`` as
+    native Python objects. Other parameters are the same as for ``get``.
+    '''
+    idx = load(path, index)
+    start, stop, _ = _slice(start, stop).indices(len(idx))
+    backend = backend or ijson.backend_name
+    with open(path, 'rb') as f:
+        for value_start, value_end in idx.ranges(start, max(start, stop)):
+            yield _parse(f, value_start, value_end, backend, config)
@@ -0,0 +1,175 @@
+'''
+Opt-in instrumentation of the parsing pipelines.
+
+A ``Stats`` object passed as ``stats`` to a backend's ``basic_parse``,
+``parse``, ``items`` or ``kvitems`` collects statistics while iterating::
+
+    stats = ijson.Stats()
+    for item in ijson.items(f, 'item', stats=stats):
+        ...
+    print(stats.as_dict())
+
+Without ``stats`` the pipelines are built exactly as before, so leaving the
+instrumentation in place costs nothing when it is not used.
+'''
+import time
+
+from ijson import utils
+
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class Stats(object):
+    '''
+    Statistics of a parsing run:
+
+    - bytes_read, reads: amount of input and number of chunks read
+    - read_time, max_read_time: total and longest time spent reading a chunk
+    - events: number of unprefixed events produced by the backend, by type
+    - max_depth: deepest nesting of containers
+    - max_string_length: length of the longest string or map key
+    - items, max_item_events: number of objects returned by ``items`` or
+      ``kvitems`` and the number of events the largest one was built from
+    - parse_time: time spent in the backend and the rest of the pipeline
+    - consumer_time: time spent by the consumer between getting results
+
+    If ``callback`` is given, it is called with the Stats object after each
+    chunk of input once at least ``interval`` seconds have passed since the
+    last call (or the start).
+    '''
+    def __init__(self, callback=None, interval=1.0):
+        self.callback = callback
+        self.interval = interval
+        self.bytes_read = 0
+        self.reads = 0
+        self.read_time = 0.0
+        self.max_read_time = 0.0
+        self.events = {}
+        self.max_depth = 0
+        self.max_string_length = 0
+        self.items = 0
+        self.max_item_events = 0
+        self.parse_time = 0.0
+        self.consumer_time = 0.0
+        self._item_events = 0
+
+    def as_dict(self):
+        '''
+        Returns the statistics as a dictionary.
+        '''
+        return dict(
+            (name, value) for name, value in self.__dict__.items()
+            if not name.startswith('_') and name not in ('callback', 'interval')
+        )
+
+    def __repr__(self):
+        return 'Stats(%s)' % ', '.join(
+            '%s=%r' % item for item in sorted(self.as_dict().items()))
+
+
+@utils.coroutine
+def events_coro(target, stats):
+    '''
+    Coroutine counting the unprefixed events it forwards to ``target`` by
+    type and tracking their nesting depth and longest strings.
+    '''
+    send = target.send
+    counts = stats.events
+    depth = 0
+    while True:
+        event = (yield)
+        name, value = event
+        counts[name] = counts.get(name, 0) + 1
+        if name == 'start_map' or name == 'start_array':
+            depth += 1
+            if depth > stats.max_depth:
+                stats.max_depth = depth
+        elif name == 'end_map' or name == 'end_array':
+            depth -= 1
+        elif name == 'string' or name == 'map_key':
+            if len(value) > stats.max_string_length:
+                stats.max_string_length = len(value)
+        send(event)
+
+
+@utils.coroutine
+def item_events_coro(target, stats, prefix):
+    '''
+    Coroutine counting the prefixed events under ``prefix`` it forwards to
+    ``target``, the events objects returned by ``items`` are built from.
+    '''
+    send = target.send
+    subprefix = prefix + '.'
+    while True:
+        event = (yield)
+        current = event[0]
+        if not prefix or current == prefix or current.startswith(subprefix):
+            stats._item_events += 1
+        send(event)
+
+
+class _Objects(list):
+    # collects objects, updating the item statistics
+    def __init__(self, stats):
+        super(_Objects, self).__init__()
+        self.stats = stats
+
+    def send(self, obj):
+        stats = self.stats
+        stats.items += 1
+        if stats._item_events > stats.max_item_events:
+            stats.max_item_events = stats._item_events
+        stats._item_events = 0
+        self.append(obj)
+
+
+def coros2gen(source, stats, basic_parse, pipeline=(), prefix=None):
+    '''
+    Instrumented counterpart of ``utils.coros2gen(source, basic_parse,
+    *pipeline)``, collecting statistics into ``stats``. ``prefix`` is the
+    prefix of the objects returned by the pipeline (ending with ``items_coro``
+    or ``kvitems_coro``), if any.
+    '''
+    pipeline = [basic_parse, (events_coro, (stats,), {})] + list(pipeline)
+    if prefix is None:
+        results = utils.sendable_list()
+    else:
+        pipeline.insert(-1, (item_events_coro, (stats, prefix), {}))
+        results = _Objects(stats)
+    f = utils.chain(results, *pipeline)
+    chunks = iter(source)
+    last_callback = timer()
+    try:
+        while True:
+            start = timer()
+            try:
+                value = next(chunks)
+            except StopIteration:
+                break
+            read = timer()
+            stats.reads += 1
+            stats.bytes_read += len(value)
+            stats.read_time += read - start
+            if read - start > stats.max_read_time:
+                stats.max_read_time = read - start
+            try:
+                f.send(value)
+            except StopIteration:
+                pass
+            parsed = timer()
+            stats.parse_time += parsed - read
+            for result in results:
+                yield result
+            del results[:]
+            now = timer()
+            stats.consumer_time += now - parsed
+            if stats.callback is not None and now - last_callback >= stats.interval:
+                last_callback = now
+                stats.callback(stats)
+    finally:
+        f.close()
+        value = None
+        close_source = getattr(source, 'close', None)
+        if close_source is not None:
+            close_source()
@@ -0,0 +1,361 @@
+'''
+Parsing of large files on several cores.
+
+The file is split into byte ranges, each range is parsed in a worker process
+of a ``multiprocessing`` pool, and the objects found in the ranges are
+yielded in the order of the file or as soon as they are ready:
+
+- ``items_parallel`` handles files with many top-level JSON values (JSON
+  Lines or concatenated JSON documents), split at document boundaries and
+  parsed with a backend supporting the ``multiple_values`` option.
+- ``array_items_parallel`` handles a single large array, split between its
+  elements after a structural scan of the file (see ``element_ranges``).
+
+Only ``TASKS_PER_WORKER`` ranges per worker are handed out ahead of the
+objects being consumed, so memory use stays bounded with slow consumers.
+'''
+from collections import deque
+import os
+from multiprocessing import Pool, cpu_count
+
+import ijson
+from ijson import common, utils
+from ijson.backends import python
+
+
+# Size of the byte ranges the file is split into
+RANGE_SIZE = 16 * 1024 * 1024
+
+# Backends able to parse multiple top-level values, fastest first
+MULTIPLE_VALUES_BACKENDS = ('yajl2_cffi', 'yajl2', 'python')
+
+
+def line_boundaries(f, size, range_size=RANGE_SIZE):
+    '''
+    Yields the offsets at which a JSON Lines file of ``size`` bytes can be
+    split into ranges of about ``range_size`` bytes: the starts of the first
+    lines following every ``range_size`` bytes. Newlines can't appear inside
+    JSON values, so every line start is a document boundary.
+    '''
+    start = 0
+    while True:
+        f.seek(start + range_size)
+        pos = f.tell()
+        while True:
+            data = f.read(python.BUFSIZE)
+            if not data:
+                return
+            end = data.find(b'\n')
+            if end != -1:
+                break
+            pos += len(data)
+        start = pos + end + 1
+        if start >= size:
+            return
+        yield start
+
+
+class _ValueEnds(object):
+    '''
+    Target of the python backend's ``lexer_coro`` collecting the ends of the
+    first top-level containers ending after every ``range_size`` bytes. The
+    lexer is told to skip every container, so apart from top-level scalars
+    it only reports brackets closing them.
+    '''
+    def __init__(self, skip, range_size):
+        self.skip = skip
+        self.range_size = range_size
+        self.start = 0
+        self.boundaries = []
+
+    def send(self, lexeme):
+        pos, symbol = lexeme
+        if symbol == '[' or symbol == '{':
+            self.skip.append(symbol)
+        elif (symbol == ']' or symbol == '}') and pos >= self.start + self.range_size:
+            self.start = pos + 1
+            self.boundaries.append(self.start)
+
+
+def value_boundaries(f, size, range_size=RANGE_SIZE):
+    '''
+    Yields the offsets at which a file of concatenated JSON documents can be
+    split into ranges of about ``range_size`` bytes: the ends of the first
+    top-level containers ending after every ``range_size`` bytes. The file is
+    scanned from the start, only tracking strings and brackets.
+    '''
+    skip = []
+    ends = _ValueEnds(skip, range_size)
+    lexer = python.lexer_coro(ends, skip)
+    f.seek(0)
+    while True:
+        data = f.read(python.BUFSIZE)
+        try:
+            lexer.send(data)
+        except StopIteration:
+            data = None
+        for end in ends.boundaries:
+            if end < size:
+                yield end
+        del ends.boundaries[:]
+        if data is None:
+            return
+
+
+class _Elements(common.Skipper):
+    '''
+    Skipper for the python backend's parser that, besides refusing values
+    that are neither on the way to, nor under the prefix, refuses the values
+    at the prefix too, recording the byte range each of them spans. It also
+    stands between the lexer and the parser to know the position of the
+    lexeme being parsed.
+
+    Ranges are recorded as ``(start, end, parent)`` tuples, ``parent``
+    numbering the array holding the value, or None if it isn't an array
+    item. Only items of the same array are separated by nothing but commas.
+    '''
+    def __init__(self, prefix):
+        super(_Elements, self).__init__(prefix)
+        self.parser = None
+        self.pos = self.symbol = None
+        self.start = self.parent = None
+        self.ranges = []
+        # the parent numbers of the containers on the way to the prefix
+        self.parents = []
+        self.arrays = 0
+
+    def send(self, lexeme):
+        self.pos, self.symbol = lexeme
+        self.parser.send(lexeme)
+
+    def event(self, event, value=None):
+        if self.depth:
+            accepted = super(_Elements, self).event(event, value)
+            if not self.depth and self.start is not None:
+                # end of a value at the prefix, not of an irrelevant one
+                self.ranges.append((self.start, self.pos + 1, self.parent))
+                self.start = None
+            return accepted
+        if self.child > len(self.prefix) and event not in ('map_key', 'end_map', 'end_array'):
+            parent = self.parents[-1] if self.parents else None
+            if event == 'start_map' or event == 'start_array':
+                # the lexer skips the rest of the value and only reports
+                # its closing bracket
+                self.start = self.pos
+                self.parent = parent
+                self.depth = 1
+            else:
+                end = self.pos + len(self.symbol.encode('utf-8'))
+                self.ranges.append((self.pos, end, parent))
+            return False
+        accepted = super(_Elements, self).event(event, value)
+        if accepted and event == 'start_array':
+            self.arrays += 1
+            self.parents.append(self.arrays)
+        elif accepted and event == 'start_map':
+            self.parents.append(None)
+        elif event == 'end_map' or event == 'end_array':
+            self.parents.pop()
+        return accepted
+
+
+def element_ranges(file, prefix, buf_size=python.BUFSIZE):
+    '''
+    Iterator returning a ``(start, end)`` tuple with the byte offsets of
+    every value found under a given prefix (like ``items`` would return
+    them), in a file-like object, a path or a buffer (see
+    ``ijson.utils.source``).
+
+    It's a structural scan made with the python backend: values at the
+    prefix and everything not leading to it are skipped by the lexer, which
+    only tracks strings and brackets inside them.
+    '''
+    for start, end, parent in _element_ranges(file, prefix, buf_size):
+        yield start, end
+
+
+def _element_ranges(file, prefix, buf_size=python.BUFSIZE):
+    # element_ranges with the parent of every range, see _Elements
+    elements = _Elements(prefix)
+    skip = []
+    events = utils.sendable_list()
+    elements.parser = python.parser_coro(events, elements, skip)
+    lexer = python.lexer_coro(elements, skip)
+    for data in utils.source(file, buf_size):
+        try:
+            lexer.send(data)
+        except StopIteration:
+            elements.parser.send((None, None))
+        del events[:]
+        for element in elements.ranges:
+            yield element
+        del elements.ranges[:]
+
+
+def _element_groups(path, prefix, range_size):
+    # lists of byte spans covering consecutive values of about range_size
+    # bytes together, whatever array they belong to. Items of the same array
+    # are separated by nothing but commas, so each span covers a run of them
+    # and the spans of a group joined by commas make a valid array once
+    # wrapped in brackets. The file is passed open, as paths given as byte
+    # strings would be taken for the data itself (see utils.source).
+    spans = []
+    size = 0
+    parent = None
+    with open(path, 'rb') as f:
+        for start, end, element_parent in _element_ranges(f, prefix):
+            if spans and element_parent is not None and element_parent == parent:
+                size += end - spans[-1][1]
+                spans[-1] = (spans[-1][0], end)
+            else:
+                size += end - start
+                spans.append((start, end))
+            parent = element_parent
+            if size >= range_size:
+                yield spans
+                spans = []
+                size = 0
+    if spans:
+        yield spans
+
+
+def _array_items_group(args):
+    path, spans, backend_name, config = args
+    backend = ijson.get_backend(backend_name)
+    parts = []
+    with open(path, 'rb') as f:
+        for start, end in spans:
+            f.seek(start)
+            parts.append(f.read(end - start))
+    data = b'[' + b','.join(parts) + b']'
+    return list(backend.items(data, 'item', **config))
+
+
+def array_items_parallel(path, prefix='item', workers=None, ordered=True,
+                         range_size=RANGE_SIZE, backend=None, **config):
+    '''
+    Iterator returning the native Python objects found under ``prefix`` in
+    the file at ``path``, like ``items``, parsing groups of them in parallel.
+    The file is scanned for the byte ranges of the objects first (see
+    ``element_ranges``), which only tracks strings and brackets inside them
+    and runs while workers parse the groups found so far.
+
+    The objects, normally the items of a large array, are sent to workers in
+    groups of about ``range_size`` bytes. Other parameters are the same as
+    for ``items_parallel``, except that workers use the fastest backend by
+    default.
+    '''
+    backend = backend or ijson.backend_name
+    tasks = (
+        (path, spans, backend, config)
+        for spans in _element_groups(path, prefix, range_size)
+    )
+    return _map(_array_items_group, tasks, workers, ordered)
+
+
+def _ranges(path, lines, range_size):
+    # the pool consumes tasks in a background thread, so scanning for
+    # boundaries overlaps with parsing the ranges found so far
+    size = os.path.getsize(path)
+    boundaries = line_boundaries if lines else value_boundaries
+    with open(path, 'rb') as f:
+        start = 0
+        for end in boundaries(f, size, range_size):
+            yield start, end
+            start = end
+    yield start, size
+
+
+def _items_range(args):
+    path, start, end, prefix, backend_name, config = args
+    backend = ijson.get_backend(backend_name)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    if not data or data.isspace():
+        return []
+    return list(backend.items(data, prefix, multiple_values=True, **config))
+
+
+def _default_backend_name():
+    if ijson.backend_name in MULTIPLE_VALUES_BACKENDS:
+        return ijson.backend_name
+    for name in MULTIPLE_VALUES_BACKENDS:
+        try:
+            ijson.get_backend(name)
+            return name
+        except ImportError:
+            pass
+
+
+def items_parallel(path, prefix, workers=None, ordered=True, lines=True,
+                   range_size=RANGE_SIZE, backend=None, **config):
+    '''
+    Iterator returning the native Python objects found under ``prefix`` in
+    every top-level value of the file at ``path``, like ``items`` with the
+    ``multiple_values`` option, parsing ranges of the file in parallel.
+
+    Parameters:
+
+    - path: path to a file of JSON Lines (each line holding a document) or,
+      with ``lines=False``, of concatenated JSON documents
+    - prefix: prefix of the objects to return in each document, '' for the
+      documents themselves
+    - workers: number of worker processes, ``os.cpu_count()`` by default
+    - ordered: if False, objects are yielded range by range as soon as
+      workers are done with them, instead of in the order of the file
+    - lines: whether the file is split at line starts; otherwise it is
+      scanned for the ends of top-level containers (see ``value_boundaries``),
+      and documents that aren't containers are never split apart
+    - range_size: approximate size of the ranges handed to workers
+    - backend: name of the backend used by workers, the fastest one
+      supporting ``multiple_values`` by default
+    - config: backend-specific options, see ``basic_parse_coro``
+    '''
+    backend = backend or _default_backend_name()
+    # ranges are always parsed with multiple_values
+    config.pop('multiple_values', None)
+    tasks = (
+        (path, start, end, prefix, backend, config)
+        for start, end in _ranges(path, lines, range_size)
+    )
+    return _map(_items_range, tasks, workers, ordered)
+
+
+# Number of tasks per worker submitted ahead of the objects being consumed
+TASKS_PER_WORKER = 2
+
+
+def _first_ready(pending):
+    # removes and returns the first of the pending results to be ready
+    while True:
+        for result in pending:
+            if result.ready():
+                pending.remove(result)
+                return result
+        pending[0].wait(0.01)
+
+
+def _map(func, tasks, workers, ordered):
+    # only a few tasks per worker are pending at once, so that neither the
+    # scan for ranges nor the results held in memory run far ahead of
+    # a slow consumer
+    workers = workers or cpu_count()
+    pool = Pool(workers)
+    try:
+        tasks = iter(tasks)
+        pending = deque()
+        while True:
+            for task in tasks:
+                pending.append(pool.apply_async(func, (task,)))
+                if len(pending) >= TASKS_PER_WORKER * workers:
+                    break
+            if not pending:
+                break
+            result = pending.popleft() if ordered else _first_ready(pending)
+            for obj in result.get():
+                yield obj
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
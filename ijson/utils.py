@@ -1,5 +1,12 @@
 # -*- coding:utf-8 -*-
+import bz2
 from functools import wraps
+from itertools import chain as iterchain
+import mmap
+import threading
+import zlib
+
+from ijson.compat import bytetype, queue, texttype
 
 
 def coroutine(func):
@@ -15,6 +22,319 @@ def coroutine(func):
         return g
     return wrapper
 
+class sendable_list(list):
+    '''
+    A list that can be used as the final target of a coroutine pipeline:
+    values sent to it are appended to it.
+    '''
+    send = list.append
+
+
+def chain(sink, *coro_pipeline):
+    '''
+    Chains together a sink and a number of coroutines to form a pipeline.
+    Each element of ``coro_pipeline`` is a ``(coroutine_func, args, kwargs)``
+    tuple; the first one receives the values sent to the pipeline, the last
+    one sends its values to ``sink``. Returns the first coroutine.
+    '''
+    f = sink
+    for coroutine_func, args, kwargs in reversed(coro_pipeline):
+        f = coroutine_func(f, *args, **kwargs)
+    return f
+
+
+def file_source(f, buf_size, offset=None):
+    '''
+    Yields chunks of data read from a file-like object, starting at
+    ``offset`` if given, followed by a final empty chunk marking the end of
+    input.
+    '''
+    if offset is not None:
+        f.seek(offset)
+    while True:
+        data = f.read(buf_size)
+        yield data
+        if not data:
+            break
+
+
+def buffer_source(data, buf_size, offset=None):
+    '''
+    Yields ``buf_size`` long slices of an object supporting the buffer
+    protocol (bytes, bytearray, mmap, memoryview...) as memoryviews, so no
+    data is copied, starting at ``offset`` if given, followed by a final
+    empty chunk marking the end of input.
+    '''
+    try:
+        view = memoryview(data)
+    except TypeError:
+        # objects only supporting the old buffer protocol, like mmap under
+        # Python 2, are sliced instead, which copies the data
+        view = data
+    else:
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast('B')
+    for start in range(offset or 0, len(view), buf_size):
+        yield view[start:start + buf_size]
+    yield b''
+
+
+def path_source(path, buf_size, offset=None):
+    '''
+    Yields chunks of the file at ``path``, which is memory-mapped when
+    possible (see ``buffer_source``) and read otherwise, followed by a final
+    empty chunk marking the end of input.
+    '''
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # empty files and files that can't be mapped, like pipes
+            for chunk in file_source(f, buf_size, offset):
+                yield chunk
+            return
+        chunks = buffer_source(data, buf_size, offset)
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            chunk = None
+            chunks.close()
+            try:
+                data.close()
+            except BufferError:
+                # a chunk is still referenced elsewhere, the file gets
+                # unmapped once it's garbage collected
+                pass
+
+
+def source(input, buf_size, offset=None):
+    '''
+    Returns an iterator over chunks of ``input``, which can be a readable
+    file-like object (seekable if ``offset`` is given), a path (see
+    ``path_source``) or an object supporting the buffer protocol (see
+    ``buffer_source``), starting at byte ``offset`` if given. The last chunk
+    is empty.
+
+    Paths are text strings or ``os.PathLike`` objects. Byte strings are
+    always the input itself, so under Python 2, where ``str`` is bytes,
+    paths must be given as ``unicode``.
+    '''
+    if isinstance(input, texttype) or hasattr(input, '__fspath__'):
+        return path_source(input, buf_size, offset)
+    if hasattr(input, 'read') and not isinstance(input, mmap.mmap):
+        return file_source(input, buf_size, offset)
+    return buffer_source(input, buf_size, offset)
+
+
+def _gzip_decompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def _xz_decompressor():
+    # not available under Python 2
+    import lzma
+    return lzma.LZMADecompressor()
+
+
+# Magic bytes starting compressed input, with the decompressor factories
+DECOMPRESSORS = (
+    (b'\x1f\x8b', _gzip_decompressor),
+    (b'BZh', bz2.BZ2Decompressor),
+    (b'\xfd7zXZ\x00', _xz_decompressor),
+)
+MAGIC_SIZE = max(len(magic) for magic, factory in DECOMPRESSORS)
+
+
+def _decompressed(decompressor, data, size):
+    '''
+    Yields the data decompressed from ``data``, in chunks of at most ``size``
+    bytes when the decompressor can limit its output (zlib always does, bz2
+    and lzma under Python 3.5 and newer).
+    '''
+    while True:
+        if hasattr(decompressor, 'unconsumed_tail'):
+            output = decompressor.decompress(data, size)
+            data = decompressor.unconsumed_tail
+            more = bool(data)
+        elif hasattr(decompressor, 'needs_input'):
+            output = decompressor.decompress(data, size)
+            data = b''
+            more = not decompressor.needs_input and not decompressor.eof
+        else:
+            output = decompressor.decompress(data)
+            more = False
+        if output:
+            yield output
+        if not more:
+            break
+
+
+def decompress_source(source, buf_size):
+    '''
+    Iterator over the chunks of ``source``, decompressed if it starts with the
+    magic bytes of gzip, bzip2 or xz data and passed through otherwise.
+    Decompressed chunks are at most ``buf_size`` bytes long when possible
+    (see ``_decompressed``), and concatenated compressed streams (like
+    multi-member gzip files) are supported. Compressed input ending before
+    the end of its stream raises ``EOFError``, except under Python 2 where
+    decompressors can't tell. The source is closed when the iterator is
+    done.
+    '''
+    chunks = iter(source)
+    try:
+        head = []
+        magic = b''
+        for chunk in chunks:
+            head.append(chunk)
+            if isinstance(chunk, texttype):
+                break
+            magic += memoryview(chunk)[:MAGIC_SIZE - len(magic)].tobytes()
+            if len(magic) == MAGIC_SIZE or not chunk:
+                break
+        for prefix, factory in DECOMPRESSORS:
+            if magic.startswith(prefix):
+                break
+        else:
+            for chunk in iterchain(head, chunks):
+                yield chunk
+            return
+
+        decompressor = factory()
+        for chunk in iterchain(head, chunks):
+            if not chunk:
+                break
+            data = chunk if isinstance(chunk, bytetype) else memoryview(chunk).tobytes()
+            if getattr(decompressor, 'eof', False):
+                # the next one of concatenated streams
+                decompressor = factory()
+            while data:
+                for output in _decompressed(decompressor, data, buf_size):
+                    yield output
+                data = decompressor.unused_data
+                if data:
+                    decompressor = factory()
+        chunk = data = None
+        if hasattr(decompressor, 'flush'):
+            output = decompressor.flush()
+            if output:
+                yield output
+        if not getattr(decompressor, 'eof', True):
+            raise EOFError('Compressed input ended before the end of its stream')
+        yield b''
+    finally:
+        chunk = None
+        close_source = getattr(source, 'close', None)
+        if close_source is not None:
+            close_source()
+
+
+def prefetch_source(source, prefetch):
+    '''
+    Iterator over the chunks of ``source`` read ahead by a background thread,
+    which holds up to ``prefetch`` chunks not consumed yet. Reading the input
+    thus overlaps with processing it, as long as the processing releases the
+    GIL (like the yajl backends do while parsing) or the reads wait on I/O.
+    Errors raised by ``source`` are re-raised by the iterator. The source is
+    closed by the thread once it's done. Closing the iterator early doesn't
+    wait for the thread, which may be blocked reading a stalled input: it
+    stops, closing the source, as soon as its current read returns.
+    '''
+    chunks = queue.Queue(prefetch)
+    closed = threading.Event()
+
+    def read():
+        try:
+            for chunk in source:
+                chunks.put((chunk, None))
+                if closed.is_set():
+                    break
+        except Exception as e:
+            chunks.put((None, e))
+        finally:
+            chunk = None
+            close_source = getattr(source, 'close', None)
+            if close_source is not None:
+                close_source()
+
+    thread = threading.Thread(target=read, name='ijson-prefetch')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            chunk, error = chunks.get()
+            if error is not None:
+                raise error
+            yield chunk
+            if not chunk:
+                break
+    finally:
+        chunk = None
+        closed.set()
+        # makes room for the chunk the thread may be waiting to queue, after
+        # which it sees it has to stop
+        while True:
+            try:
+                chunks.get_nowait()
+            except queue.Empty:
+                break
+
+
+def coros2gen(source, *coro_pipeline):
+    '''
+    Iterator sending each value of ``source`` through a pipeline of coroutines
+    (see ``chain``) and yielding the values that come out of it. Pipelines
+    stop once they receive the end of input, so the StopIteration raised by
+    the last ``send`` is expected. The pipeline and the source (if it can be
+    closed) are closed when the iterator is done, releasing any resources
+    held by the coroutines or the source.
+    '''
+    events = sendable_list()
+    f = chain(events, *coro_pipeline)
+    try:
+        for value in source:
+            try:
+                f.send(value)
+            except StopIteration:
+                pass
+            for event in events:
+                yield event
+            del events[:]
+    finally:
+        f.close()
+        # the last chunk may pin a memory-mapped file
+        value = None
+        close_source = getattr(source, 'close', None)
+        if close_source is not None:
+            close_source()
+
+
+def coros2batches(source, *coro_pipeline):
+    '''
+    Like ``coros2gen``, but yields the values that come out of the pipeline
+    for each value of ``source`` together in one list, skipping empty ones.
+    '''
+    events = sendable_list()
+    f = chain(events, *coro_pipeline)
+    try:
+        for value in source:
+            try:
+                f.send(value)
+            except StopIteration:
+                pass
+            if events:
+                batch = events[:]
+                del events[:]
+                yield batch
+    finally:
+        f.close()
+        # the last chunk may pin a memory-mapped file
+        value = None
+        close_source = getattr(source, 'close', None)
+        if close_source is not None:
+            close_source()
+
+
 @coroutine
 def foreach(coroutine_func):
     '''
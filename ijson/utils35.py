@@ -0,0 +1,70 @@
+'''
+Asynchronous counterparts of the iterators in ``ijson.utils``. This module
+uses Python 3.5 syntax and is only imported under Python 3.5 and newer.
+'''
+from ijson import utils
+
+
+class file_source(object):
+    '''
+    Asynchronous iterator yielding chunks of data read from a file-like object
+    with an awaitable ``read`` method (like ``asyncio.StreamReader``),
+    followed by a final empty chunk marking the end of input.
+    '''
+    def __init__(self, f, buf_size):
+        self.f = f
+        self.buf_size = buf_size
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.done:
+            raise StopAsyncIteration
+        data = await self.f.read(self.buf_size)
+        if not data:
+            self.done = True
+        return data
+
+
+class coros2gen(object):
+    '''
+    Asynchronous iterator sending each value of an asynchronous ``source``
+    through a pipeline of coroutines (see ``ijson.utils.chain``) and yielding
+    the values that come out of it.
+
+    If waiting for the source fails, including when the waiting task is
+    cancelled, the pipeline is closed right away so that coroutines release
+    their resources (like yajl handles) before the exception propagates.
+    ``aclose`` does the same for consumers that stop iterating early.
+    '''
+    def __init__(self, source, *coro_pipeline):
+        self.source = source.__aiter__()
+        self.events = utils.sendable_list()
+        self.coro = utils.chain(self.events, *coro_pipeline)
+        self.pos = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        events = self.events
+        while self.pos == len(events):
+            del events[:]
+            self.pos = 0
+            try:
+                value = await self.source.__anext__()
+            except BaseException:
+                self.coro.close()
+                raise
+            try:
+                self.coro.send(value)
+            except StopIteration:
+                pass
+        event = events[self.pos]
+        self.pos += 1
+        return event
+
+    async def aclose(self):
+        self.coro.close()
@@ -1,6 +1,52 @@
 from importlib import import_module
+from distutils.errors import CCompilerError, DistutilsExecError, DistutilsFileError, \
+                            DistutilsPlatformError
+import sys
 
 from setuptools import setup, find_packages
+from setuptools.command.build_ext import build_ext
+
+
+class optional_build_ext(build_ext):
+    '''
+    Builds the compiled module of the yajl2_cffi backend if a C compiler and
+    the yajl headers are available. Otherwise the backend uses cffi's ABI
+    mode, so failures only produce a warning.
+    '''
+    errors = (CCompilerError, DistutilsExecError, DistutilsPlatformError, IOError)
+    failed = False
+
+    def run(self):
+        try:
+            build_ext.run(self)
+        except self.errors as e:
+            self.warn_fallback(e)
+        except DistutilsFileError:
+            # copying the module that failed to build in place
+            if not self.failed:
+                raise
+
+    def build_extension(self, ext):
+        try:
+            build_ext.build_extension(self, ext)
+        except self.errors as e:
+            self.warn_fallback(e)
+
+    def warn_fallback(self, error):
+        self.failed = True
+        sys.stderr.write(
+            'WARNING: building the compiled yajl2_cffi module failed (%s), '
+            'the backend will use cffi in ABI mode\n' % error
+        )
+
+
+options = {}
+try:
+    import cffi
+    options['cffi_modules'] = ['ijson/backends/_yajl2_cffi_build.py:build_ffi']
+except ImportError:
+    pass
+
 
 setup(
     name = 'ijson',
@@ -21,4 +67,6 @@ setup(
     ],
 
     packages = find_packages(),
+    cmdclass = {'build_ext': optional_build_ext},
+    **options
 )
@@ -1,14 +1,25 @@
 # -*- coding:utf-8 -*-
 from __future__ import unicode_literals
 import unittest
+import bz2
+from collections import namedtuple
 from io import BytesIO, StringIO
 from decimal import Decimal
+import mmap
+import os
+import sys
+import tempfile
 import threading
+import zlib
 from importlib import import_module
 
+import ijson
 from ijson import common
 from ijson.backends.python import basic_parse, Lexer
-from ijson.compat import IS_PY2
+from ijson.compat import IS_PY2, IS_PY35
+if IS_PY35:
+    import asyncio
+from ijson.utils import sendable_list
 
 
 JSON = b'''
@@ -115,9 +126,49 @@ STRINGS_JSON = br'''
 }
 '''
 NUMBERS_JSON = b'[1, 1.0, 1E2]'
+SKIPPING_JSON = b'''
+{
+  "skipped": {"nested": [1, {"a": "b", "c": ["]", "}", "\\"["]}], "s": "{["},
+  "a.b": [1, 2],
+  "a": {"b": [3, {"c": 4}], "x": [5, 6]},
+  "list": [{"k": 1, "v": [7]}, {"k": 2, "v": []}, [8]]
+}
+'''
+SKIPPING_PREFIXES = [
+    '', 'skipped', 'skipped.nested.item', 'a.b', 'a.b.item', 'a.b.item.c',
+    'a.x.item', 'list.item', 'list.item.k', 'list.item.v.item', 'list.item.item',
+    'missing', 'a.missing.item',
+]
 SURROGATE_PAIRS_JSON = b'"\uD83D\uDCA9"'
 
 
+class AsyncFile(object):
+    '''
+    File-like object with an awaitable ``read`` method serving the given data,
+    followed by reads that never complete if ``stall`` is set.
+    '''
+    def __init__(self, loop, data, stall=False):
+        self.loop = loop
+        self.f = BytesIO(data)
+        self.stall = stall
+
+    def read(self, size):
+        future = self.loop.create_future()
+        data = self.f.read(size)
+        if data or not self.stall:
+            future.set_result(data)
+        return future
+
+
+def collect_async(loop, aiterator):
+    result = []
+    while True:
+        try:
+            result.append(loop.run_until_complete(aiterator.__anext__()))
+        except StopAsyncIteration:
+            return result
+
+
 class Parse(object):
     '''
     Base class for parsing tests that is used to create test cases for each
@@ -142,6 +193,14 @@ class Parse(object):
         self.assertEqual(strings, ['', '"', '\\', '\\\\', '\b\f\n\r\t'])
         self.assertTrue(('map_key', 'special\t') in events)
 
+    def test_raw_strings(self):
+        events = list(self.backend.basic_parse(BytesIO(STRINGS_JSON), raw_strings=True))
+        strings = [value for event, value in events if event == 'string']
+        self.assertEqual(strings, [b'', b'"', b'\\', b'\\\\', b'\b\f\n\r\t'])
+        self.assertTrue(('map_key', 'special\t') in events)
+        doc = next(self.backend.items(BytesIO(JSON), 'docs.item', raw_strings=True, buf_size=5))
+        self.assertEqual(doc['string'], 'строка - тест'.encode('utf-8'))
+
     def test_surrogate_pairs(self):
         event = next(self.backend.basic_parse(BytesIO(SURROGATE_PAIRS_JSON)))
         parsed_string = event[1]
@@ -152,6 +211,16 @@ class Parse(object):
         types = [type(value) for event, value in events if event == 'number']
         self.assertEqual(types, [int, Decimal, Decimal])
 
+    def test_numbers_use_float(self):
+        events = list(self.backend.basic_parse(BytesIO(NUMBERS_JSON), use_float=True))
+        values = [value for event, value in events if event == 'number']
+        self.assertEqual(values, [1, 1.0, 100.0])
+        self.assertEqual([type(value) for value in values], [int, float, float])
+        doc = next(self.backend.items(BytesIO(JSON), 'docs.item', use_float=True))
+        self.assertEqual(doc['double'], 0.5)
+        self.assertEqual(type(doc['double']), float)
+        self.assertEqual(doc['long'], 10000000000)
+
     def test_invalid(self):
         for json in INVALID_JSONS:
             # Yajl1 doesn't complain about additional data after the end
@@ -188,10 +257,324 @@ class Parse(object):
         events = list(self.backend.basic_parse(BytesIO(JSON), buf_size=buf_size))
         self.assertEqual(events, JSON_EVENTS)
 
+    def test_long_string(self):
+        # escapes and multibyte characters straddle the chunk boundaries
+        json = b'["' + 'x\\"\\\\ \u0441'.encode('utf-8') * 10000 + b'"]'
+        events = list(self.backend.basic_parse(BytesIO(json), buf_size=1000))
+        self.assertEqual(events[1], ('string', 'x"\\ \u0441' * 10000))
+
+    def test_buffer_input(self):
+        for data in (JSON, bytearray(JSON), memoryview(JSON)):
+            events = list(self.backend.basic_parse(data, buf_size=5))
+            self.assertEqual(events, JSON_EVENTS)
+
+    def test_path_input(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(JSON)
+            # byte strings are documents, paths must be text
+            if IS_PY2:
+                path = path.decode(sys.getfilesystemencoding())
+            else:
+                with self.assertRaises(common.JSONError):
+                    list(self.backend.basic_parse(path.encode('utf-8')))
+            self.assertEqual(list(self.backend.basic_parse(path)), JSON_EVENTS)
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.assertEqual(list(self.backend.basic_parse(data)), JSON_EVENTS)
+            finally:
+                data.close()
+            items = self.backend.items(path, 'docs.item.meta')
+            self.assertEqual(next(items), [[1], {}])
+            # stopping early releases the file
+            items.close()
+        finally:
+            os.remove(path)
+
+    def test_positional_options(self):
+        # all backends take buf_size second, their options as keywords
+        self.assertEqual(list(self.backend.basic_parse(BytesIO(JSON), 5)), JSON_EVENTS)
+        with self.assertRaises(TypeError):
+            list(self.backend.basic_parse(BytesIO(JSON), True))
+
+    def test_text_input(self):
+        events = list(self.backend.basic_parse(StringIO(JSON.decode('utf-8')), buf_size=5))
+        self.assertEqual(events, JSON_EVENTS)
+        self.assertEqual(list(self.backend.items(StringIO('[1]'), 'item')), [1])
+
+    def test_invalid_utf8(self):
+        with self.assertRaises((common.JSONError, UnicodeDecodeError)):
+            list(self.backend.basic_parse(BytesIO(b'["\xff"]')))
+
+    def test_prefetch(self):
+        events = list(self.backend.basic_parse(BytesIO(JSON), buf_size=5, prefetch=2))
+        self.assertEqual(events, JSON_EVENTS)
+        batches = self.backend.basic_parse_batches(BytesIO(JSON), buf_size=5, prefetch=2)
+        self.assertEqual(sum(batches, []), JSON_EVENTS)
+        # stopping early doesn't wait for a stalled read, after which the
+        # reading thread stops
+        stalled = threading.Event()
+        resume = threading.Event()
+        class StalledFile(BytesIO):
+            def read(self, size):
+                # past the end of the first item
+                if self.tell() >= 260:
+                    stalled.set()
+                    resume.wait()
+                return BytesIO.read(self, size)
+        items = self.backend.items(StalledFile(JSON), 'docs.item', buf_size=5, prefetch=100)
+        self.assertEqual(next(items)['string'], 'строка - тест')
+        stalled.wait()
+        items.close()
+        readers = [t for t in threading.enumerate() if t.name == 'ijson-prefetch']
+        self.assertTrue(any(reader.is_alive() for reader in readers))
+        resume.set()
+        for reader in readers:
+            reader.join(5)
+            self.assertFalse(reader.is_alive())
+        # errors reading the input are raised by the parser
+        class FailingFile(object):
+            def read(self, size):
+                raise IOError('read failed')
+        with self.assertRaises(IOError):
+            list(self.backend.basic_parse(FailingFile(), prefetch=2))
+
+    def test_compressed(self):
+        def gzip(data):
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            return compressor.compress(data) + compressor.flush()
+        inputs = [gzip(JSON), bz2.compress(JSON), gzip(JSON[:100]) + gzip(JSON[100:])]
+        if not IS_PY2:
+            import lzma
+            inputs.append(lzma.compress(JSON))
+        for data in inputs:
+            for buf_size in (5, 64 * 1024):
+                events = list(self.backend.basic_parse(BytesIO(data), buf_size=buf_size))
+                self.assertEqual(events, JSON_EVENTS)
+            events = list(self.backend.basic_parse(data, buf_size=5, prefetch=2))
+            self.assertEqual(events, JSON_EVENTS)
+            if not IS_PY2:
+                with self.assertRaises(EOFError):
+                    list(self.backend.basic_parse(BytesIO(data[:-10])))
+            with self.assertRaises(common.JSONError):
+                list(self.backend.basic_parse(BytesIO(data), decompress=False))
+        fd, path = tempfile.mkstemp(suffix='.json.gz')
+        if IS_PY2:
+            path = path.decode(sys.getfilesystemencoding())
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(inputs[0])
+            items = self.backend.items(path, 'docs.item.meta')
+            self.assertEqual(next(items), [[1], {}])
+            items.close()
+        finally:
+            os.remove(path)
+
+    def test_deep_nesting(self):
+        depth = sys.getrecursionlimit() + 100
+        json = b'[' * depth + b'1' + b']' * depth
+        events = list(self.backend.basic_parse(BytesIO(json)))
+        self.assertEqual(len(events), 2 * depth + 1)
+        self.assertEqual(events[depth], ('number', 1))
+
     def test_api(self):
         self.assertTrue(list(self.backend.items(BytesIO(JSON), '')))
         self.assertTrue(list(self.backend.parse(BytesIO(JSON))))
 
+    def test_kvitems(self):
+        pairs = list(self.backend.kvitems(BytesIO(JSON), 'docs.item'))
+        self.assertEqual([key for key, value in pairs][:3], ['null', 'boolean', 'true'])
+        self.assertEqual(pairs[-3:], [
+            ('meta', [[1], {}]),
+            ('meta', {'key': 'value'}),
+            ('meta', None),
+        ])
+        self.assertEqual(list(self.backend.kvitems(BytesIO(JSON), 'docs.item.meta')), [('key', 'value')])
+        self.assertEqual(list(self.backend.kvitems(BytesIO(JSON), 'docs')), [])
+
+    def test_batches(self):
+        batches = list(self.backend.basic_parse_batches(BytesIO(JSON), buf_size=64))
+        self.assertTrue(len(batches) > 1)
+        self.assertEqual([e for batch in batches for e in batch], JSON_EVENTS)
+        batches = self.backend.parse_batches(BytesIO(JSON), buf_size=64)
+        prefixed = list(self.backend.parse(BytesIO(JSON)))
+        self.assertEqual([e for batch in batches for e in batch], prefixed)
+        for prefix in ('docs.item.meta', 'docs.item.meta.item', ''):
+            batches = list(self.backend.items_batches(BytesIO(JSON), prefix, buf_size=64))
+            self.assertTrue(all(batches))
+            self.assertEqual([o for batch in batches for o in batch],
+                             list(self.backend.items(BytesIO(JSON), prefix)))
+
+    def test_stats(self):
+        stats = ijson.Stats()
+        items = list(self.backend.items(BytesIO(JSON), 'docs.item', buf_size=64, stats=stats))
+        self.assertEqual(items, list(self.backend.items(BytesIO(JSON), 'docs.item')))
+        self.assertEqual(stats.bytes_read, len(JSON))
+        self.assertEqual(stats.reads, len(JSON) // 64 + 2)
+        self.assertEqual(stats.items, 4)
+        self.assertEqual(stats.max_item_events, 18)
+        self.assertEqual(stats.events['start_map'], 7)
+        self.assertEqual(stats.max_depth, 5)
+        calls = []
+        stats = ijson.Stats(callback=calls.append, interval=0)
+        events = list(self.backend.basic_parse(BytesIO(JSON), stats=stats))
+        self.assertEqual(events, JSON_EVENTS)
+        self.assertEqual(sum(stats.events.values()), len(JSON_EVENTS))
+        self.assertEqual(stats.max_string_length, len('строка - тест'))
+        self.assertEqual(calls, [stats] * stats.reads)
+
+    def test_limits(self):
+        def parse(json, **limits):
+            return list(self.backend.basic_parse(BytesIO(json), buf_size=10, **limits))
+        self.assertEqual(parse(JSON, max_depth=5, max_total_bytes=len(JSON)), JSON_EVENTS)
+        string = b'["' + b'a' * 100 + b'"]'
+        self.assertEqual(len(parse(string, max_string_bytes=100)), 3)
+        for limits in ({'max_depth': 4}, {'max_total_bytes': len(JSON) - 1}):
+            with self.assertRaises(common.LimitExceededError):
+                parse(JSON, **limits)
+        with self.assertRaises(common.LimitExceededError):
+            parse(string, max_string_bytes=99)
+        with self.assertRaises(common.LimitExceededError):
+            parse(b'[' * 1000 + b']' * 1000, max_depth=100)
+        items = list(self.backend.items(BytesIO(JSON), 'docs.item', max_item_bytes=200))
+        self.assertEqual(len(items), 4)
+        with self.assertRaises(common.LimitExceededError):
+            list(self.backend.items(BytesIO(JSON), 'docs.item', max_item_bytes=20))
+        batches = list(self.backend.items_batches(BytesIO(JSON), 'docs.item', max_item_bytes=200))
+        self.assertEqual(sum(batches, []), items)
+        with self.assertRaises(common.LimitExceededError):
+            list(self.backend.items_batches(BytesIO(JSON), 'docs.item', max_item_bytes=20))
+        # kvitems limits each pair, not the whole map
+        json = ('{%s}' % ','.join('"%d": [%d]' % (i, i) for i in range(100))).encode('utf-8')
+        pairs = list(self.backend.kvitems(BytesIO(json), '', max_item_bytes=10))
+        self.assertEqual(len(pairs), 100)
+        with self.assertRaises(common.LimitExceededError):
+            list(self.backend.kvitems(BytesIO(JSON), 'docs.item', max_item_bytes=20))
+        with self.assertRaises(TypeError):
+            list(self.backend.parse(BytesIO(JSON), max_item_bytes=20))
+
+    def test_items_types(self):
+        Meta = namedtuple('Meta', 'key')
+        Meta.__new__.__defaults__ = (None,)
+        items = list(self.backend.items(BytesIO(JSON), 'docs.item.meta', array_type=tuple,
+                                        map_type=lambda pairs: Meta(**dict(pairs))))
+        self.assertEqual(items, [((1,), Meta(key=None)), Meta(key='value'), None])
+        pairs = list(self.backend.kvitems(BytesIO(JSON), 'docs.item', array_type=tuple))
+        self.assertEqual(pairs[8], ('meta', ((1,), {})))
+
+    def test_shared_keys(self):
+        json = b'[' + b','.join([b'{"key": 1, "\\u006bey2": 2}'] * 3) + b']'
+        docs = list(self.backend.items(BytesIO(json), 'item', buf_size=10))
+        self.assertEqual(docs, [{'key': 1, 'key2': 2}] * 3)
+        keys = [sorted(doc) for doc in docs]
+        self.assertTrue(keys[0][0] is keys[1][0] is keys[2][0])
+        self.assertTrue(keys[0][1] is keys[1][1] is keys[2][1])
+
+    def test_parser(self):
+        parser = self.backend.Parser()
+        for json, events in [(JSON, JSON_EVENTS), (SCALAR_JSON, [('number', 0)])] * 2:
+            self.assertEqual(parser.basic_parse_bytes(json), events)
+        for json in (INVALID_JSONS[0], INCOMPLETE_JSONS[3], b''):
+            with self.assertRaises(common.JSONError):
+                parser.basic_parse_bytes(json)
+        self.assertEqual(parser.basic_parse_bytes(memoryview(JSON)), JSON_EVENTS)
+        parser = self.backend.Parser(array_type=tuple, use_float=True)
+        self.assertEqual(parser.parse_bytes(b'[1, [2.5], {"a": []}]'), (1, (2.5,), {'a': ()}))
+        parser = self.backend.Parser(max_depth=4, max_string_bytes=20)
+        self.assertEqual(parser.basic_parse_bytes(SCALAR_JSON), [('number', 0)])
+        for json in (JSON, b'["' + b'a' * 21 + b'"]'):
+            with self.assertRaises(common.LimitExceededError):
+                parser.basic_parse_bytes(json)
+
+    def test_kvitems_coro(self):
+        pairs = sendable_list()
+        self._feed(self.backend.kvitems_coro(pairs, ''), JSON, 10)
+        self.assertEqual(len(pairs), 1)
+        self.assertEqual(pairs[0][0], 'docs')
+        self.assertEqual(len(pairs[0][1]), 4)
+
+    def test_items_skipping(self):
+        for prefix in SKIPPING_PREFIXES:
+            expected = list(common.items(common.parse(basic_parse(BytesIO(SKIPPING_JSON))), prefix))
+            for buf_size in (1, 5, 64 * 1024):
+                result = list(self.backend.items(BytesIO(SKIPPING_JSON), prefix, buf_size=buf_size))
+                self.assertEqual(result, expected)
+
+    def test_items_skipping_incomplete(self):
+        with self.assertRaises(common.IncompleteJSONError):
+            list(self.backend.items(BytesIO(b'{"skipped": [{"a": 1}, '), 'a'))
+
+    def test_items_skipping_limits(self):
+        json = b'{"skipped": [{"b": "' + b'a' * 100 + b'"}], "a": 1}'
+        for buf_size in (5, 64 * 1024):
+            items = self.backend.items(BytesIO(json), 'a', buf_size=buf_size, max_string_bytes=100)
+            self.assertEqual(list(items), [1])
+            with self.assertRaises(common.LimitExceededError):
+                list(self.backend.items(BytesIO(json), 'a', buf_size=buf_size,
+                                        max_string_bytes=99))
+
+    def _feed(self, coro, data, chunk_size):
+        for i in range(0, len(data), chunk_size):
+            coro.send(data[i:i + chunk_size])
+        with self.assertRaises(StopIteration):
+            coro.send(b'')
+
+    def test_basic_parse_coro(self):
+        for chunk_size in (1, 7, len(JSON)):
+            events = sendable_list()
+            self._feed(self.backend.basic_parse_coro(events), JSON, chunk_size)
+            self.assertEqual(events, JSON_EVENTS)
+
+    def test_items_coro(self):
+        meta = sendable_list()
+        self._feed(self.backend.items_coro(meta, 'docs.item.meta'), JSON, 10)
+        self.assertEqual(meta, [[[1], {}], {'key': 'value'}, None])
+
+    def test_async(self):
+        if not IS_PY35:
+            return
+        loop = asyncio.new_event_loop()
+        try:
+            events = collect_async(loop, self.backend.basic_parse_async(AsyncFile(loop, JSON), buf_size=32))
+            self.assertEqual(events, JSON_EVENTS)
+            events = collect_async(loop, self.backend.parse_async(AsyncFile(loop, JSON)))
+            self.assertEqual(events, list(self.backend.parse(BytesIO(JSON))))
+            meta = collect_async(loop, self.backend.items_async(AsyncFile(loop, JSON), 'docs.item.meta'))
+            self.assertEqual(meta, [[[1], {}], {'key': 'value'}, None])
+            pairs = collect_async(loop, self.backend.kvitems_async(AsyncFile(loop, JSON), 'docs.item.meta'))
+            self.assertEqual(pairs, [('key', 'value')])
+            with self.assertRaises(common.IncompleteJSONError):
+                collect_async(loop, self.backend.basic_parse_async(AsyncFile(loop, INCOMPLETE_JSONS[4])))
+        finally:
+            loop.close()
+
+    def test_async_cancel(self):
+        if not IS_PY35:
+            return
+        loop = asyncio.new_event_loop()
+        try:
+            events = self.backend.basic_parse_async(AsyncFile(loop, b'[1, 2', stall=True))
+            self.assertEqual(loop.run_until_complete(events.__anext__()), ('start_array', None))
+            self.assertEqual(loop.run_until_complete(events.__anext__()), ('number', 1))
+            task = loop.create_task(events.__anext__())
+            loop.run_until_complete(asyncio.sleep(0))
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                loop.run_until_complete(task)
+            # parsing coroutine is closed and has released its resources
+            self.assertTrue(events.coro.gi_frame is None)
+        finally:
+            loop.close()
+
+    def test_coro_incomplete(self):
+        for json in INCOMPLETE_JSONS[1:]:
+            coro = self.backend.basic_parse_coro(sendable_list())
+            coro.send(json)
+            with self.assertRaises(common.IncompleteJSONError):
+                coro.send(b'')
+
 # Generating real TestCase classes for each importable backend
 for name in ['python', 'yajl', 'yajl2', 'yajl2_cffi']:
     try:
@@ -247,6 +630,23 @@ class Common(unittest.TestCase):
             builder.event(event, value)
         self.assertEqual(builder.value, 0)
 
+    def test_builder_types(self):
+        builder = common.ObjectBuilder(map_type=tuple, array_type=tuple)
+        for event, value in basic_parse(BytesIO(b'{"a": {"b": [1, {}], "c": []}, "d": 2}')):
+            builder.event(event, value)
+        self.assertEqual(builder.value, (
+            ('a', (('b', (1, ())), ('c', ()))),
+            ('d', 2),
+        ))
+
+    def test_key_cache(self):
+        decoded = []
+        keys = common.KeyCache(lambda raw: decoded.append(raw) or raw.upper(), size=2)
+        self.assertEqual([keys[raw] for raw in 'aabab'], ['A', 'A', 'B', 'A', 'B'])
+        self.assertEqual(keys['c'], 'C')
+        self.assertEqual(len(keys), 1)
+        self.assertEqual(decoded, ['a', 'b', 'c'])
+
     def test_parse(self):
         events = common.parse(basic_parse(BytesIO(JSON)))
         events = [value
@@ -255,6 +655,23 @@ class Common(unittest.TestCase):
         ]
         self.assertEqual(events, [1])
 
+    def test_parse_empty_keys(self):
+        events = common.parse(basic_parse(BytesIO(b'{"": {"": [1]}, "a": 2}')))
+        prefixes = [(prefix, event) for prefix, event, value in events]
+        self.assertEqual(prefixes, [
+            ('', 'start_map'),
+            ('', 'map_key'),
+            ('', 'start_map'),
+            ('', 'map_key'),
+            ('.', 'start_array'),
+            ('..item', 'number'),
+            ('.', 'end_array'),
+            ('', 'end_map'),
+            ('', 'map_key'),
+            ('a', 'number'),
+            ('', 'end_map'),
+        ])
+
     def test_items(self):
         events = basic_parse(BytesIO(JSON))
         meta = list(common.items(common.parse(events), 'docs.item.meta'))
@@ -264,6 +681,237 @@ class Common(unittest.TestCase):
             None,
         ])
 
+    def test_kvitems(self):
+        events = common.parse(basic_parse(BytesIO(JSON)))
+        pairs = list(common.kvitems(events, 'docs.item.meta'))
+        self.assertEqual(pairs, [('key', 'value')])
+
+    def test_items_async(self):
+        if not IS_PY35:
+            return
+        from ijson.backends import python
+        loop = asyncio.new_event_loop()
+        try:
+            events = python.basic_parse_async(AsyncFile(loop, JSON))
+            meta = collect_async(loop, common.items_async(common.parse_async(events), 'docs.item.meta'))
+        finally:
+            loop.close()
+        self.assertEqual(meta, [
+            [[1], {}],
+            {'key': 'value'},
+            None,
+        ])
+
+
+class Backends(unittest.TestCase):
+    def test_default(self):
+        self.assertTrue(ijson.backend_name in ijson.BACKENDS)
+        self.assertTrue(ijson.backend is ijson.get_backend(ijson.backend_name))
+        self.assertTrue(ijson.items is ijson.backend.items)
+
+    def test_env_override(self):
+        os.environ['IJSON_BACKEND'] = 'python'
+        try:
+            name, backend = ijson._default_backend()
+        finally:
+            del os.environ['IJSON_BACKEND']
+        self.assertEqual(name, 'python')
+        self.assertTrue(backend is import_module('ijson.backends.python'))
+
+    def test_unknown(self):
+        with self.assertRaises(ImportError):
+            ijson.get_backend('nonexistent')
+
+    def test_defaults(self):
+        # the backends chosen by default behave the same
+        self.assertFalse('yajl' in ijson.DEFAULT_BACKENDS)
+        for name in ijson.DEFAULT_BACKENDS:
+            try:
+                backend = ijson.get_backend(name)
+            except ImportError:
+                continue
+            self.assertEqual(list(backend.items(StringIO('[1]'), 'item')), [1])
+            self.assertEqual(list(backend.items(BytesIO(b'[1]'), 'item', 4096)), [1])
+            events = list(backend.basic_parse(BytesIO(b'[1] [2]'), multiple_values=True))
+            self.assertEqual(len(events), 6)
+            with self.assertRaises(TypeError):
+                list(backend.basic_parse(BytesIO(b'[1]'), True))
+            with self.assertRaises(common.JSONError):
+                list(backend.basic_parse(BytesIO(b'{"a": 1} garbage')))
+            with self.assertRaises((common.JSONError, UnicodeDecodeError)):
+                list(backend.basic_parse(BytesIO(b'["\xff"]')))
+
+
+class Benchmark(unittest.TestCase):
+    def test_run(self):
+        from ijson import benchmark
+        corpora = [('numbers', benchmark.numbers(10), 'item')]
+        backends = benchmark.available_backends(['python'])
+        results = list(benchmark.run(corpora, backends, buf_sizes=(None, 4)))
+        self.assertEqual(len(results), 6)
+        counts = dict(((r['method'], r['buf_size']), r['count']) for r in results)
+        self.assertEqual(counts[('basic_parse', 4)], 12)
+        self.assertEqual(counts[('items', 16 * 1024)], 10)
+
+
+class Parallel(unittest.TestCase):
+    DOCS = [{'id': i, 'text': 'a\n"}' * (i % 3), 'list': [i, {}]} for i in range(50)]
+
+    def setUp(self):
+        import json
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            for doc in self.DOCS:
+                f.write(json.dumps(doc) + '\n')
+        fd, self.concatenated_path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            for doc in self.DOCS:
+                f.write(json.dumps(doc, indent=2))
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.remove(self.concatenated_path)
+
+    def test_multiple_values(self):
+        from ijson.backends import python
+        items = python.items(BytesIO(b'{"a": 1} [2]3 "4"'), '', multiple_values=True)
+        self.assertEqual(list(items), [{'a': 1}, [2], 3, '4'])
+        with self.assertRaises(common.JSONError):
+            list(python.items(BytesIO(b'{"a": 1} [2]'), ''))
+
+    def test_lines(self):
+        from ijson import parallel
+        items = parallel.items_parallel(self.path, '', workers=2, range_size=100)
+        self.assertEqual(list(items), self.DOCS)
+        items = parallel.items_parallel(self.path, 'id', workers=2, range_size=100, ordered=False)
+        self.assertEqual(sorted(items), list(range(50)))
+        items = parallel.items_parallel(self.path, '', workers=2, multiple_values=True)
+        self.assertEqual(list(items), self.DOCS)
+
+    def test_concatenated(self):
+        from ijson import parallel
+        with open(self.concatenated_path, 'rb') as f:
+            size = os.path.getsize(self.concatenated_path)
+            self.assertTrue(len(list(parallel.value_boundaries(f, size, 100))) > 10)
+        items = parallel.items_parallel(self.concatenated_path, 'list.item', workers=2,
+                                        lines=False, range_size=100)
+        self.assertEqual(list(items), [x for doc in self.DOCS for x in doc['list']])
+
+    def test_pending_tasks(self):
+        import time
+        from ijson import parallel
+        submitted = []
+        def tasks():
+            for i in range(100):
+                submitted.append(i)
+                yield (i,)
+        for ordered in (True, False):
+            del submitted[:]
+            results = parallel._map(list, tasks(), 2, ordered)
+            first = next(results)
+            time.sleep(0.1)
+            # no more tasks are submitted until objects are consumed
+            self.assertTrue(len(submitted) <= 2 * parallel.TASKS_PER_WORKER)
+            self.assertEqual(sorted([first] + list(results)), list(range(100)))
+
+    def test_element_ranges(self):
+        from ijson import parallel
+        ranges = parallel.element_ranges(BytesIO(JSON), 'docs.item.meta', buf_size=5)
+        self.assertEqual([JSON[start:end] for start, end in ranges],
+                         [b'[[1], {}]', b'{"key": "value"}', b'null'])
+        ranges = parallel.element_ranges(JSON, 'docs.item.string')
+        self.assertEqual([JSON[start:end] for start, end in ranges],
+                         [b'"\\u0441\\u0442\\u0440\\u043e\\u043a\\u0430 - \xd1\x82\xd0\xb5\xd1\x81\xd1\x82"'])
+
+    def test_array(self):
+        import json
+        from ijson import parallel
+        with open(self.path, 'w') as f:
+            json.dump({'docs': self.DOCS}, f)
+        items = parallel.array_items_parallel(self.path, 'docs.item', workers=2, range_size=100)
+        self.assertEqual(list(items), self.DOCS)
+
+    def test_array_nested(self):
+        import json
+        from ijson import parallel
+        with open(self.path, 'w') as f:
+            json.dump(self.DOCS, f)
+        for range_size in (100, 10 ** 9):
+            items = parallel.array_items_parallel(self.path, 'item.list.item', workers=2,
+                                                  range_size=range_size)
+            self.assertEqual(list(items), [x for doc in self.DOCS for x in doc['list']])
+            items = parallel.array_items_parallel(self.path, 'item.id', workers=2,
+                                                  range_size=range_size)
+            self.assertEqual(list(items), [doc['id'] for doc in self.DOCS])
+        # values of different arrays are grouped together too
+        groups = list(parallel._element_groups(self.path, 'item.list.item', 10 ** 9))
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(len(groups[0]), len(self.DOCS))
+
+
+class Index(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(JSON)
+
+    def tearDown(self):
+        for path in (self.path, self.path + '.ijsonidx', self.path + '.ijsonidx.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_get(self):
+        from ijson import index
+        idx = index.build(self.path, 'docs.item.meta')
+        self.assertEqual(len(idx), 3)
+        self.assertEqual(index.get(self.path, 1), {'key': 'value'})
+        self.assertEqual(index.get(self.path, -3), [[1], {}])
+        with self.assertRaises(IndexError):
+            index.get(self.path, 3)
+        self.assertEqual(list(index.slice(self.path, 1)), [{'key': 'value'}, None])
+        self.assertEqual(list(index.slice(self.path, 5, 10)), [])
+
+    def test_stale(self):
+        from ijson import index
+        index.build(self.path, 'docs.item.meta')
+        with open(self.path, 'wb') as f:
+            f.write(b'{"docs": [{"meta": 1}, {"meta": 2}]}')
+        # a different size invalidates the index even within the mtime resolution
+        self.assertEqual(index.get(self.path, 1), 2)
+        self.assertEqual(len(index.load(self.path)), 2)
+
+    def test_truncated(self):
+        from ijson import index
+        with open(self.path, 'wb') as f:
+            f.write(JSON[:len(JSON) // 2])
+        with self.assertRaises(common.IncompleteJSONError):
+            index.build(self.path, 'docs.item.meta')
+        self.assertFalse(os.path.exists(self.path + '.ijsonidx.tmp'))
+        self.assertFalse(os.path.exists(self.path + '.ijsonidx'))
+
+
+class Resumable(unittest.TestCase):
+    def _check(self, func, prefix):
+        import json
+        results = list(func(BytesIO(JSON), prefix, buf_size=7))
+        self.assertTrue(results)
+        for i, (obj, checkpoint) in enumerate(results):
+            checkpoint = json.loads(json.dumps(checkpoint))
+            resumed = func(BytesIO(JSON), prefix, checkpoint=checkpoint, buf_size=7)
+            self.assertEqual(list(resumed), results[i + 1:])
+
+    def test_items(self):
+        from ijson.backends import python
+        objects = [obj for obj, checkpoint in python.items_resumable(BytesIO(JSON), 'docs.item')]
+        self.assertEqual(objects, list(python.items(BytesIO(JSON), 'docs.item')))
+        for prefix in ('docs.item', 'docs.item.meta', 'docs.item.meta.item', 'docs.item.string'):
+            self._check(python.items_resumable, prefix)
+
+    def test_kvitems(self):
+        from ijson.backends import python
+        for prefix in ('docs.item', 'docs.item.meta'):
+            self._check(python.kvitems_resumable, prefix)
+
 
 class Stream(unittest.TestCase):
     def test_bytes(self):
@@ -274,6 +922,15 @@ class Stream(unittest.TestCase):
         l = Lexer(StringIO(JSON.decode('utf-8')))
         self.assertEqual(next(l)[1], '{')
 
+    def test_long_number(self):
+        # scanned once over all the chunks, not again on each one
+        json = b'[' + b'1' * 100000 + b', true]'
+        lexemes = [lexeme for pos, lexeme in Lexer(BytesIO(json), 10)]
+        self.assertEqual(lexemes, ['[', '1' * 100000, ',', 'true', ']'])
+        for buf_size in (10, 64 * 1024):
+            with self.assertRaises(common.LimitExceededError):
+                list(basic_parse(BytesIO(json), buf_size=buf_size, max_string_bytes=99999))
+
 
 if __name__ == '__main__':
     unittest.main()